@@ -8,16 +8,16 @@
 
 """
 
-import re
+# only cheap modules are imported here, so that short lived processes
+# start quickly: re, json, base64 and the rest are imported on first use
+
 import io
-import base64
 import sys
 
 if sys.version_info.minor > 6 or sys.version_info.minor == 6 and sys.implementation.name == 'cpython':
     OrderedDict = dict
-    from collections import namedtuple
 else:
-    from collections import namedtuple, OrderedDict
+    from collections import OrderedDict
 
 from datetime import datetime, timedelta, timezone
 
@@ -86,25 +86,91 @@ number_widths = {
 
 # Regular Expressions for Tokenizing Input
 
-whitespace = re.compile(r"(?:\ |\t|\uFEFF|\r|\n|#[^\r\n]*(?:\r?\n|$))+")
+class Regex:
+    """A regular expression, compiled the first time it is used
+
+    Compiling replaces these methods with the compiled pattern's own, so
+    afterwards a call costs no more than it would on the pattern.
+    """
+
+    methods = ('match', 'search', 'finditer', 'findall', 'sub')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def compile(self):
+        import re
+        compiled = re.compile(self.pattern)
+        for name in self.methods:
+            setattr(self, name, getattr(compiled, name))
+        return compiled
+
+    def match(self, *args):
+        return self.compile().match(*args)
+
+    def search(self, *args):
+        return self.compile().search(*args)
+
+    def finditer(self, *args):
+        return self.compile().finditer(*args)
 
-int_b2 = re.compile(r"0b[01][01_]*")
-int_b8 = re.compile(r"0o[0-7][0-7_]*")
-int_b10 = re.compile(r"\d[\d_]*")
-int_b16 = re.compile(r"0x[0-9a-fA-F][0-9a-fA-F_]*")
+    def findall(self, *args):
+        return self.compile().findall(*args)
 
-flt_b10 = re.compile(r"\.[\d_]+")
-exp_b10 = re.compile(r"[eE](?:\+|-)?[\d+_]")
+    def sub(self, *args):
+        return self.compile().sub(*args)
 
-string_dq = re.compile(
+whitespace = Regex(r"(?:\ |\t|\uFEFF|\r|\n|#[^\r\n]*(?:\r?\n|$))+")
+
+int_b2 = Regex(r"0b[01][01_]*")
+int_b8 = Regex(r"0o[0-7][0-7_]*")
+int_b10 = Regex(r"\d[\d_]*")
+int_b16 = Regex(r"0x[0-9a-fA-F][0-9a-fA-F_]*")
+
+flt_b10 = Regex(r"\.[\d_]+")
+exp_b10 = Regex(r"[eE](?:\+|-)?[\d_]+")
+
+string_dq = Regex(
     r'"(?:[^"\\\n\x00-\x1F\x7F-\x9F\uD800-\uDFFF]|\\(?:[\'"\\/bfnrt]|\r?\n|x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}))*"')
-string_sq = re.compile(
+string_sq = Regex(
     r"'(?:[^'\\\n\x00-\x1F\x7F-\x9F\uD800-\uDFFF]|\\(?:[\"'\\/bfnrt]|\r?\n|x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}))*'")
 
-tag_name = re.compile(r"@(?!\d)\w+[ ]+")
-identifier = re.compile(r"(?!\d)[\w\.]+")
-
-c99_flt = re.compile(
+# the opening quote and contents of a string, to see how far a long one goes
+string_dq_open = Regex(string_dq.pattern[:-1])
+string_sq_open = Regex(string_sq.pattern[:-1])
+
+tag_name = Regex(r"@(?!\d)\w+[ ]+")
+identifier = Regex(r"(?!\d)[\w\.]+")
+
+# a line that starts a new document in a multi-document input
+document_boundary = Regex(r"\n(?=[^\s#,:\]\}])")
+
+# the rest of a document, up to whitespace, that a chunk could have cut short
+run_on = Regex(r"[^\s\uFEFF#]*")
+
+# json strings that arson reads differently: C1 controls and surrogates
+json_unsafe = Regex(r"[\x7F-\x9F\uD800-\uDFFF]|\\u[dD][89a-fA-F]")
+
+def cut_off(buf, pos):
+    """Could an error at pos be from the end of buf cutting a document short?"""
+    if pos is None:
+        return False
+    if buf.find('\n', pos) == -1:
+        return True  # on the last line
+    # or in a string that runs to the end, give or take an escape
+    if buf[pos] == '"':
+        return string_dq_open.match(buf, pos).end() >= len(buf) - 10
+    if buf[pos] == "'":
+        return string_sq_open.match(buf, pos).end() >= len(buf) - 10
+    return False
+
+# skip to the next bracket (or comma), passing over strings and comments
+list_skip = Regex(
+    r'''(?:[^\[\]{}"'#]+|"(?:[^"\\]|\\[\s\S])*"|'(?:[^'\\]|\\[\s\S])*'|#[^\r\n]*)*''')
+list_skip_comma = Regex(
+    r'''(?:[^\[\]{}"'#,]+|"(?:[^"\\]|\\[\s\S])*"|'(?:[^'\\]|\\[\s\S])*'|#[^\r\n]*)*''')
+
+c99_flt = Regex(
     r"NaN|nan|[-+]?Inf|[-+]?inf|[-+]?0x[0-9a-fA-F][0-9a-fA-F]*\.[0-9a-fA-F]+[pP](?:\+|-)?[\d]+")
 
 str_escapes = {
@@ -170,41 +236,428 @@ class ParserErr(Exception):
                 nl = pos - 5
             reason = "Unknown Character {} (context: {})".format(
                 repr(buf[pos]), repr(buf[pos - 10:pos + 5]))
+        self.reason = reason
         Exception.__init__(self, "{} (at pos={})".format(reason, pos))
 
+# json.loads, with arson's rules for records and constants
+
+def json_pairs(pairs):
+    out = OrderedDict(pairs)
+    if len(out) != len(pairs):
+        raise ValueError("duplicate key")
+    return out
+
+def json_constant(name):
+    raise ValueError("{} is not a recognised built-in".format(name))
+
+json_decoder = None
+json_encoder = None
+
+def load_json():
+    global json_decoder, json_encoder
+    import json
+    json_decoder = json.JSONDecoder(object_pairs_hook=json_pairs, parse_constant=json_constant)
+    json_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(', ', ': '))
+
+# json.dumps, with arson's escapes for strings
+
+json_types = {str, int, bool, type(None)}
+json_escape = Regex(r"\\(?:\\|u00([01][0-9a-f]))")
+
+def json_control(m):
+    if m.group(1):
+        return "\\x" + m.group(1).upper()
+    return m.group(0)
+
+def dump_json(obj):
+    if json_encoder is None:
+        load_json()
+    out = json_encoder.encode(obj)
+    if "'" in out: # only appears inside strings
+        out = out.replace("'", "\\'")
+    if "\\u00" in out:
+        out = json_escape.sub(json_control, out)
+    return out
+
+class SemanticErr(Exception):
+    def __init__(self, reason, buf=None, pos=None):
+        self.buf = buf
+        self.pos = pos
+        self.reason = reason
+        if pos is not None:
+            reason = "{} (at pos={})".format(reason, pos)
+        Exception.__init__(self, reason)
+
+class LimitErr(ParserErr):
+    def __init__(self, buf, pos, limit, value):
+        self.limit = limit
+        self.value = value
+        ParserErr.__init__(self, buf, pos, "{} exceeded: {}".format(limit, value))
+
+class Limits:
+    """Limits for parsing untrusted input, where None means no limit
+
+    - max_size: length of the whole input
+    - max_depth: how deeply lists and records can be nested
+    - max_string: length of a string or bytestring literal
+    - max_digits: length of a number literal
+    - max_items: number of items in a list or record
+    - max_nodes: number of values (including keys) in a document
+    """
+
+    def __init__(self, max_size=None, max_depth=None, max_string=None,
+            max_digits=None, max_items=None, max_nodes=None):
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.max_digits = max_digits
+        self.max_items = max_items
+        self.max_nodes = max_nodes
+
+class LimitCheck:
+    """Counts nodes and depth while parsing one document, raising LimitErr"""
+
+    def __init__(self, limits, buf):
+        self.limits = limits
+        self.depth = 0
+        self.nodes = 0
+        if limits.max_size is not None and len(buf) > limits.max_size:
+            raise LimitErr(buf, limits.max_size, "max_size", len(buf))
+
+    def node(self, buf, pos):
+        self.nodes += 1
+        if self.limits.max_nodes is not None and self.nodes > self.limits.max_nodes:
+            raise LimitErr(buf, pos, "max_nodes", self.nodes)
+
+    def enter(self, buf, pos):
+        self.depth += 1
+        if self.limits.max_depth is not None and self.depth > self.limits.max_depth:
+            raise LimitErr(buf, pos, "max_depth", self.depth)
+
+    def items(self, buf, pos, n):
+        if self.limits.max_items is not None and n >= self.limits.max_items:
+            raise LimitErr(buf, pos, "max_items", n + 1)
+
+    def string_end(self, buf, pos):
+        """Where to stop looking for the end of a string at pos"""
+        if self.limits.max_string is None:
+            return len(buf)
+        return min(len(buf), pos + self.limits.max_string + 2)
+
+    def long_string(self, buf, pos, opening, end):
+        """Raise LimitErr if a string that didn't end before end goes past it"""
+        if end < len(buf):
+            m = opening.match(buf, pos, end + 10) # an escape can cross the end
+            if m.end() >= end:
+                raise LimitErr(buf, pos, "max_string", m.end() - pos - 1)
+
+    def string(self, buf, pos, n):
+        if self.limits.max_string is not None and n > self.limits.max_string:
+            raise LimitErr(buf, pos, "max_string", n)
+
+    def number(self, buf, pos, n):
+        if self.limits.max_digits is not None and n > self.limits.max_digits:
+            raise LimitErr(buf, pos, "max_digits", n)
+
+class DocumentError:
+    """An error in one document of a multi-document input
+
+    Records the document number, where it started, and the exception.
+    The line, column, and byte offset are worked out on demand. When
+    reading a stream, buf is the part of it read so far, which starts on
+    line first_line, at byte first_offset.
+    """
+
+    def __init__(self, buf, index, start, exception, first_line=1, first_offset=0):
+        self.buf = buf
+        self.index = index
+        self.start = start
+        self.exception = exception
+        self.pos = exception.pos if exception.pos is not None else start
+        self.first_line = first_line
+        self.first_offset = first_offset
+
+    @property
+    def line(self):
+        return self.buf.count('\n', 0, self.pos) + self.first_line
+
+    @property
+    def column(self):
+        return self.pos - self.buf.rfind('\n', 0, self.pos)
+
+    @property
+    def offset(self):
+        return len(self.buf[:self.pos].encode('utf-8', 'surrogatepass')) + self.first_offset
+
+    def __repr__(self):
+        return "<DocumentError {} at line {}, column {}: {}>".format(
+                self.index, self.line, self.column, self.exception)
+
+class ParseHooks:
+    __slots__ = ('record', 'list', 'string', 'tags', 'columnar')
+
+    def __init__(self, record, list, string, tags, columnar):
+        self.record = record
+        self.list = list
+        self.string = string
+        self.tags = tags
+        self.columnar = columnar
+
+    def key(self):
+        return (self.record, self.list, self.string, frozenset(self.tags.items()), self.columnar)
 
 class Codec:
     content_type = CONTENT_TYPE
 
-    def __init__(self, object_to_tagged, tagged_to_object):
+    def __init__(self, object_to_tagged, tagged_to_object, limits=None):
         self.object_to_tagged = object_to_tagged
         self.tagged_to_object = tagged_to_object
+        self.limits = limits
+
+    def check_limits(self, buf):
+        if self.limits is None:
+            return None
+        return LimitCheck(self.limits, buf)
+
+    def parse(self, buf, transform=None, cache=None, refs=False,
+            record_hook=None, list_hook=None, string_hook=None, tag_hooks=None,
+            try_json=False, columnar=False):
+        if record_hook or list_hook or string_hook or tag_hooks or columnar:
+            hooks = ParseHooks(record_hook, list_hook, string_hook, tag_hooks or {}, columnar)
+        else:
+            hooks = None
+
+        if cache is not None:
+            return cache.parse(self, buf, transform, refs, hooks, try_json)
+        return self.parse_document(buf, transform, refs, hooks, try_json)
+
+    def parse_document(self, buf, transform=None, refs=False, hooks=None, try_json=False):
+        if try_json and transform is None and hooks is None and self.limits is None \
+                and not json_unsafe.search(buf):
+            # plain json is read the same way by both, and anything else
+            # (or any error) is left to parse_arson
+            if json_decoder is None:
+                load_json()
+            try:
+                return json_decoder.decode(buf)
+            except ValueError:
+                pass
+
+        limits = self.check_limits(buf)
+        obj, pos = self.parse_arson(buf, 0, transform, {} if refs else None, hooks, limits)
+        self.parse_trailing(buf, pos)
+        return obj
+
+    def parse_all(self, buf, transform=None, errors=None):
+        """Parse a sequence of documents, separated by whitespace or comments
+
+        If errors is a list, a DocumentError is added to it for each bad
+        document, and parsing carries on from the next line that starts a
+        document (one not indented, or starting with ',', ':', ']' or '}').
+        With limits, max_size applies to each document, not the whole buffer.
+        """
+        out = []
+        index = 0
+        end = len(buf)
+        max_size = self.limits.max_size if self.limits is not None else None
+
+        m = whitespace.match(buf, 0)
+        pos = m.end() if m else 0
+
+        while pos < end:
+            start = pos
+            try:
+                try:
+                    limits = self.check_limits('')
+                    obj, pos = self.parse_arson(buf, pos, transform, None, None, limits)
+                except IndexError:
+                    raise ParserErr(buf, end, "Unexpected end of input") from None
+                if max_size is not None and pos - start > max_size:
+                    raise LimitErr(buf, start, "max_size", pos - start)
+            except (ParserErr, SemanticErr) as e:
+                if errors is None:
+                    raise
+                errors.append(DocumentError(buf, index, start, e))
+                # the error can be on a line that starts a document, so
+                # look from just before it, but never before this one
+                resume = start if e.pos is None else max(start, e.pos - 1)
+                m = document_boundary.search(buf, resume)
+                pos = m.end() if m else end
+            else:
+                out.append(obj)
+            index += 1
 
-    def parse(self, buf, transform=None):
-        obj, pos = self.parse_arson(buf, 0, transform)
+            m = whitespace.match(buf, pos)
+            if m:
+                pos = m.end()
+
+        return out
+
+    def parse_stream(self, stream, transform=None, errors=None, chunk_size=64*1024):
+        """Parse a sequence of documents from a file, yielding each one in turn
+
+        Like parse_all, but the stream is read a chunk at a time, and only
+        the lines from the current document onwards are kept. A document cut
+        off by the end of a chunk is parsed again once more has been read.
+        With limits, max_size applies to each document, not the whole stream.
+        """
+        buf = ''
+        pos = 0         # where the next document can start
+        skip = None     # where to look for the next document, after an error
+        line = 1        # the line, and byte offset, that buf starts at
+        offset = 0
+        index = 0
+        eof = False
+        max_size = self.limits.max_size if self.limits is not None else None
+
+        while True:
+            if skip is not None:
+                m = document_boundary.search(buf, skip)
+                if m is not None or eof:
+                    pos = m.end() if m else len(buf)
+                    skip = None
+                else:
+                    pos = skip = max(skip, len(buf) - 1)
+
+            if skip is None:
+                m = whitespace.match(buf, pos)
+                start = m.end() if m else pos
+                if start == len(buf) and eof:
+                    return
 
+                while start < len(buf):
+                    try:
+                        try:
+                            limits = self.check_limits('')
+                            obj, end = self.parse_arson(buf, start, transform, None, None, limits)
+                        except IndexError:
+                            raise ParserErr(buf, len(buf), "Unexpected end of input") from None
+                        if max_size is not None and end - start > max_size:
+                            raise LimitErr(buf, start, "max_size", end - start)
+                    except (ParserErr, SemanticErr) as e:
+                        if not eof and cut_off(buf, e.pos):
+                            break
+                        if errors is None:
+                            raise
+                        errors.append(DocumentError(buf, index, start, e, line, offset))
+                        index += 1
+                        skip = start if e.pos is None else max(start, e.pos - 1)
+                        break
+
+                    if not eof and buf[end - 1] not in ']}"\'' \
+                            and run_on.match(buf, end).end() == len(buf):
+                        break  # a number or a name could carry on, like 2.5E- into 2.5E-3
+                    yield obj
+                    index += 1
+                    pos = end
+                    m = whitespace.match(buf, pos)
+                    start = m.end() if m else pos
+
+                if skip is not None:
+                    continue
+                if start == len(buf) and eof:
+                    return
+                if max_size is not None and len(buf) - start > max_size:
+                    e = LimitErr(buf, start, "max_size", len(buf) - start)
+                    if errors is None:
+                        raise e
+                    errors.append(DocumentError(buf, index, start, e, line, offset))
+                    index += 1
+                    skip = start
+                    continue
+
+            # keep the lines from pos (or skip) onwards, and read some more,
+            # at least doubling what's kept so large documents aren't
+            # parsed over and over again
+            cut = buf.rfind('\n', 0, pos if skip is None else min(pos, skip)) + 1
+            line += buf.count('\n', 0, cut)
+            offset += len(buf[:cut].encode('utf-8', 'surrogatepass'))
+            buf = buf[cut:]
+            pos -= cut
+            if skip is not None:
+                skip -= cut
+            data = stream.read(max(chunk_size, 4 * len(buf)))
+            if data:
+                buf += data
+            else:
+                eof = True
+
+    def parse_parallel(self, buf, transform=None, workers=None, chunk_size=4*1024*1024):
+        """Parse a large top level list, using a process pool
+
+        The list is cut into chunks of whole items, which are parsed in
+        separate processes and joined back together. Anything that isn't a
+        list, or small enough to fit in one chunk, is parsed as normal. If
+        any chunk fails, the whole document is parsed again without the pool,
+        so that errors are reported in the same way as parse().
+        """
+        self.check_limits(buf)
+        spans = split_list(buf, chunk_size)
+        if spans is None or len(spans) < 2:
+            return self.parse(buf, transform)
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        last = len(spans) - 1
+        try:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(parse_list_chunk, self, buf[lo:hi], n == last, transform)
+                        for n, (lo, hi) in enumerate(spans)]
+                out, nodes = [], 1
+                for f in futures:
+                    items, n = f.result()
+                    out.extend(items)
+                    nodes += n
+            self.parse_trailing(buf, spans[last][1] + 1)
+            if self.limits is not None:
+                # chunks can't see the whole list, so check the totals
+                if self.limits.max_items is not None and len(out) > self.limits.max_items:
+                    raise ValueError("max_items")
+                if self.limits.max_nodes is not None and nodes > self.limits.max_nodes:
+                    raise ValueError("max_nodes")
+        except Exception:
+            return self.parse(buf, transform)
+        return out
+
+    def parse_trailing(self, buf, pos):
         m = whitespace.match(buf, pos)
         if m:
             pos = m.end()
-            m = whitespace.match(buf, pos)
 
         if pos != len(buf):
             raise ParserErr(buf, pos, "Trailing content: {}".format(
                 repr(buf[pos:pos + 10])))
 
-        return obj
+    def parse_tree(self, buf):
+        """Parse a document into a Document, which keeps comments and formatting"""
+        self.parse(buf) # check the whole document first
+        doc = Document(self, buf)
+        m = whitespace.match(buf, 0)
+        doc.root, pos = doc.parse_node(m.end() if m else 0)
+        return doc
 
+    def dump(self, obj, transform=None, refs=None, use_json=False):
+        if use_json and transform is None and not refs:
+            out = self.dump_tagged(obj)
+            return dump_json(obj) if out is None else out
 
-    def dump(self, obj, transform=None):
         buf = io.StringIO('')
-        self.dump_arson(obj, buf, transform)
+        if refs:
+            refs = SharedValues(obj, by_value=(refs == 'value'))
+        else:
+            refs = None
+        self.dump_arson(obj, buf, transform, refs)
         return buf.getvalue()
 
-    def parse_arson(self, buf, pos, transform=None):
+    def parse_arson(self, buf, pos, transform=None, refs=None, hooks=None, limits=None):
         m = whitespace.match(buf, pos)
         if m:
             pos = m.end()
 
+        if limits is not None:
+            limits.node(buf, pos)
+
+        start = pos
         peek = buf[pos]
         name = None
         if peek == '@':
@@ -231,16 +684,26 @@ class Codec:
             else:
                 out = OrderedDict()
 
+            if limits is not None:
+                limits.enter(buf, pos)
+
             pos += 1
             m = whitespace.match(buf, pos)
             if m:
                 pos = m.end()
 
             while buf[pos] != '}':
-                key, pos = self.parse_arson(buf, pos, transform)
+                if limits is not None:
+                    limits.items(buf, pos, len(out))
+
+                key, pos = self.parse_arson(buf, pos, transform, refs, hooks, limits)
 
-                if key in out:
-                    raise SemanticErr('duplicate key: {}, {}'.format(key, out))
+                try:
+                    duplicate = key in out
+                except TypeError:
+                    raise SemanticErr('unhashable key: {}'.format(key), buf, pos) from None
+                if duplicate:
+                    raise SemanticErr('duplicate key: {}, {}'.format(key, out), buf, pos)
 
                 m = whitespace.match(buf, pos)
                 if m:
@@ -256,7 +719,7 @@ class Codec:
                     raise ParserErr(
                         buf, pos, "Expected key:value pair but found {}".format(repr(peek)))
                     
-                item, pos = self.parse_arson(buf, pos, transform)
+                item, pos = self.parse_arson(buf, pos, transform, refs, hooks, limits)
 
                 out[key] = item
 
@@ -274,13 +737,20 @@ class Codec:
                 elif peek != '}':
                     raise ParserErr(
                         buf, pos, "Expecting a ',', or a '}}' but found {}".format('{}',repr(peek)))
-            if name in (None, 'object', 'record', 'dict'):
-                pass
+
+            if limits is not None:
+                limits.depth -= 1
+
+            if hooks is not None and name in hooks.tags:
+                out = self.convert_tag(buf, start, name, hooks.tags[name], out)
+            elif name in (None, 'object', 'record', 'dict'):
+                if hooks is not None and hooks.record is not None:
+                    out = hooks.record(out)
             elif name in reserved_tags:
                 raise ParserErr(
                     buf, pos, "{} has no meaning for {}".format(repr(name), item))
             else:
-                out = self.tagged_to_object(name,  out)
+                out = self.convert_tag(buf, start, name, self.tagged_to_object, name, out)
 
             if transform is not None:
                 out = transform(out)
@@ -297,6 +767,14 @@ class Codec:
             else:
                 out = []
 
+            if hooks is not None and hooks.columnar and name in (None, 'object', 'list'):
+                columns = Columns()
+            else:
+                columns = None
+
+            if limits is not None:
+                limits.enter(buf, pos)
+
             pos += 1
 
             m = whitespace.match(buf, pos)
@@ -304,12 +782,24 @@ class Codec:
                 pos = m.end()
 
             while buf[pos] != ']':
-                item, pos = self.parse_arson(buf, pos, transform)
+                if limits is not None:
+                    limits.items(buf, pos, len(out) if columns is None else len(columns))
+
+                item, pos = self.parse_arson(buf, pos, transform, refs, hooks, limits)
                 if name == 'set':
-                    if item in out:
-                        raise SemanticErr('duplicate item in set: {}'.format(item))
+                    try:
+                        duplicate = item in out
+                    except TypeError:
+                        raise SemanticErr('unhashable item in set: {}'.format(item), buf, pos) from None
+                    if duplicate:
+                        raise SemanticErr('duplicate item in set: {}'.format(item), buf, pos)
                     else:
                         out.add(item)
+                elif columns is not None:
+                    if not columns.append(item):
+                        out.extend(columns)
+                        out.append(item)
+                        columns = None
                 else:
                     out.append(item)
 
@@ -329,12 +819,21 @@ class Codec:
 
             pos += 1
 
-            if name in (None, 'object', 'list', 'set'):
-                pass
+            if limits is not None:
+                limits.depth -= 1
+
+            if columns is not None:
+                out = columns if len(columns) > 1 else list(columns)
+
+            if hooks is not None and name in hooks.tags:
+                out = self.convert_tag(buf, start, name, hooks.tags[name], out)
+            elif name in (None, 'object', 'list', 'set'):
+                if hooks is not None and hooks.list is not None and type(out) is list:
+                    out = hooks.list(out)
             elif name == 'complex':
-                out = complex(*out)
+                out = self.convert_tag(buf, start, name, complex, *out)
             elif name == 'string':
-                out = "".join(out)
+                out = self.convert_tag(buf, start, name, "".join, out)
             elif name in ('u8', 'u16', 'u32', 'u64', 'u128',):
                 n_min, n_max = number_widths[name]
                 if not all(isinstance(i, int) and i >= n_min and i <= n_max for i in out):
@@ -348,8 +847,15 @@ class Codec:
             elif name in reserved_tags:
                 raise ParserErr(
                     buf, pos, "{} has no meaning for {}".format(repr(name), item))
+            elif refs is not None and name == 'define':
+                if len(out) != 2 or not isinstance(out[0], int) or isinstance(out[0], bool):
+                    raise ParserErr(buf, pos, "Expecting @define [id, value]")
+                if out[0] in refs:
+                    raise SemanticErr('duplicate definition: {}'.format(out[0]), buf, pos)
+                refs[out[0]] = out[1]
+                return out[1], pos # already transformed
             else:
-                out = self.tagged_to_object(name,  out)
+                out = self.convert_tag(buf, start, name, self.tagged_to_object, name, out)
 
             if transform is not None:
                 out = transform(out)
@@ -368,20 +874,28 @@ class Codec:
                 s = io.StringIO()
                 ascii = False
 
-            # validate string
+            # validate string, only as far as max_string allows
+            end = len(buf) if limits is None else limits.string_end(buf, pos)
             if peek == "'":
-                m = string_sq.match(buf, pos)
+                m = string_sq.match(buf, pos, end)
                 if m:
                     end = m.end()
                 else:
+                    if limits is not None:
+                        limits.long_string(buf, pos, string_sq_open, end)
                     raise ParserErr(buf, pos, "Invalid single quoted string")
             else:
-                m = string_dq.match(buf, pos)
+                m = string_dq.match(buf, pos, end)
                 if m:
                     end = m.end()
                 else:
+                    if limits is not None:
+                        limits.long_string(buf, pos, string_dq_open, end)
                     raise ParserErr(buf, pos, "Invalid double quoted string")
 
+            if limits is not None:
+                limits.string(buf, pos, end - pos - 2)
+
             lo = pos + 1  # skip quotes
             while lo < end - 1:
                 hi = buf.find("\\", lo, end)
@@ -435,6 +949,9 @@ class Codec:
                         if 0xD800 <= n <= 0xDFFF:
                             raise ParserErr(
                                 buf, hi, 'string cannot have surrogate pairs')
+                        if n > 0x10FFFF:
+                            raise ParserErr(
+                                buf, hi, 'escape is past the end of unicode')
                         s.write(chr(n))
                     lo = hi + 10
                 elif esc == '\n':
@@ -445,15 +962,20 @@ class Codec:
                     raise ParserErr(
                         buf, hi, "Unkown escape character {}".format(repr(esc)))
 
-            if name == 'bytestring':
+            if hooks is not None and name in hooks.tags:
+                out = self.convert_tag(buf, start, name, hooks.tags[name],
+                        s if name == 'bytestring' else s.getvalue())
+            elif name == 'bytestring':
                 out = s
             else:
                 out = s.getvalue()
 
                 if name in (None, 'string', 'object'):
-                    pass
+                    if hooks is not None and hooks.string is not None:
+                        out = hooks.string(out)
                 elif name == 'base64':
                     try:
+                        import base64
                         out = base64.standard_b64decode(out)
                     except Exception as e:
                         raise ParserErr(buf, pos, "Invalid base64") from e
@@ -474,7 +996,7 @@ class Codec:
                     raise ParserErr(
                         buf, pos, "{} has no meaning for {}".format(repr(name), item))
                 else:
-                    out = self.tagged_to_object(name,  out)
+                    out = self.convert_tag(buf, start, name, self.tagged_to_object, name, out)
 
             if transform is not None:
                 out = transform(out)
@@ -522,6 +1044,9 @@ class Codec:
                         raise ParserErr(
                             buf, pos, "Invalid hexadecimal number (0x...)")
 
+                if limits is not None:
+                    limits.number(buf, pos, end - pos)
+
                 out = sign * int(buf[pos + 2:end].replace('_', ''), base)
             else:
                 m = int_b10.match(buf, pos)
@@ -541,12 +1066,17 @@ class Codec:
                     exp_end = e.end()
                     end = exp_end
 
+                if limits is not None:
+                    limits.number(buf, pos, end - pos)
+
                 if flt_end or exp_end:
                     out = sign * float(buf[pos:end].replace('_', ''))
                 else:
                     out = sign * int(buf[pos:end].replace('_', ''), 10)
 
-            if name is None or name == 'object':
+            if hooks is not None and name in hooks.tags:
+                out = self.convert_tag(buf, start, name, hooks.tags[name], out)
+            elif name is None or name == 'object':
                 pass
             elif name == 'duration':
                 out = timedelta(seconds=out)
@@ -568,8 +1098,12 @@ class Codec:
             elif name in reserved_tags:
                 raise ParserErr(
                     buf, pos, "{} has no meaning for {}".format(repr(name), item))
+            elif refs is not None and name == 'ref':
+                if out not in refs:
+                    raise ParserErr(buf, pos, "Unknown reference: {}".format(out))
+                return refs[out], end # already transformed
             else:
-                out = self.tagged_to_object(name, out)
+                out = self.convert_tag(buf, start, name, self.tagged_to_object, name, out)
 
             if transform is not None:
                 out = transform(out)
@@ -589,7 +1123,9 @@ class Codec:
 
             out = builtin_names[item]
 
-            if name is None or name == 'object':
+            if hooks is not None and name in hooks.tags:
+                out = self.convert_tag(buf, start, name, hooks.tags[name], out)
+            elif name is None or name == 'object':
                 pass
             elif name == 'bool':
                 if item not in allowed_tags_for_bool:
@@ -598,7 +1134,7 @@ class Codec:
                 raise ParserErr(
                     buf, pos, "{} has no meaning for {}".format(repr(name), item))
             else:
-                out = self.tagged_to_object(name,  out)
+                out = self.convert_tag(buf, start, name, self.tagged_to_object, name, out)
 
             if transform is not None:
                 out = transform(out)
@@ -608,7 +1144,99 @@ class Codec:
 
 
 
-    def dump_arson(self, obj, buf, transform=None):
+    def convert_tag(self, buf, pos, name, convert, *args):
+        """Call convert(*args) for a tagged value, raising a ParserErr at pos if it fails"""
+        if convert is None:
+            raise ParserErr(buf, pos, "Unknown tag: @{}".format(name))
+        try:
+            return convert(*args)
+        except (ParserErr, SemanticErr):
+            raise
+        except Exception as e:
+            raise ParserErr(buf, pos, "Invalid @{}: {}".format(name, e)) from e
+
+    def dump_tagged(self, obj):
+        """Returns the arson for obj, or None if dump_json would give the same
+
+        Untagged lists and records are left to dump_json, and only the
+        containers with tagged values inside are written out here.
+        """
+        t = type(obj)
+        if t in json_types:
+            return None
+        elif t is float:
+            if obj - obj == 0.0: # not inf or nan
+                return None
+        elif t is list or t is tuple:
+            tagged = None
+            for n, x in enumerate(obj):
+                if type(x) in json_types:
+                    continue
+                out = self.dump_tagged(x)
+                if out is not None:
+                    if tagged is None:
+                        tagged = {}
+                    tagged[n] = out
+            if tagged is None:
+                return None
+            # untagged runs of items are dumped as lists, without the brackets
+            out, last = [], 0
+            for n, item in tagged.items():
+                if n > last:
+                    out.append(dump_json(obj[last:n])[1:-1])
+                out.append(item)
+                last = n + 1
+            if last < len(obj):
+                out.append(dump_json(obj[last:])[1:-1])
+            return "[{}]".format(", ".join(out))
+        elif t is dict:
+            items = list(obj.items())
+            tagged = None
+            for n, (k, v) in enumerate(items):
+                if type(k) is str:
+                    key = None
+                else:
+                    key = self.dump_tagged(k) or dump_json(k)
+                value = None if type(v) in json_types else self.dump_tagged(v)
+                if key is not None or value is not None:
+                    if tagged is None:
+                        tagged = {}
+                    tagged[n] = "{}: {}".format(
+                        dump_json(k) if key is None else key,
+                        dump_json(v) if value is None else value)
+            if tagged is None:
+                return None
+            # untagged runs of items are dumped as records, without the braces
+            out, last = [], 0
+            for n, item in tagged.items():
+                if n > last:
+                    out.append(dump_json(dict(items[last:n]))[1:-1])
+                out.append(item)
+                last = n + 1
+            if last < len(items):
+                out.append(dump_json(dict(items[last:]))[1:-1])
+            return "{{{}}}".format(", ".join(out))
+        elif t is set:
+            items = list(obj)
+            return "@set " + (self.dump_tagged(items) or dump_json(items))
+        return self.dump(obj)
+
+    def dump_arson(self, obj, buf, transform=None, refs=None):
+        if refs is not None:
+            key = refs.shared_key(obj)
+            if key is not None and key not in refs.active:
+                n = refs.ids.get(key)
+                if n is not None:
+                    buf.write('@ref {}'.format(n))
+                    return
+                n = refs.ids[key] = len(refs.ids)
+                refs.active.add(key)
+                buf.write('@define [{}, '.format(n))
+                self.dump_arson(obj, buf, transform, refs)
+                buf.write(']')
+                refs.active.discard(key)
+                return
+
         if transform:
             obj = transform(obj)
         if obj is True or obj is False or obj is None:
@@ -636,9 +1264,10 @@ class Codec:
         elif isinstance(obj, (bytes, bytearray)):
             buf.write('@base64 "')
             # assume no escaping needed
+            import base64
             buf.write(base64.standard_b64encode(obj).decode('ascii'))
             buf.write('"')
-        elif isinstance(obj, (list, tuple)):
+        elif isinstance(obj, (list, tuple, Columns)):
             buf.write('[')
             first = True
             for x in obj:
@@ -646,7 +1275,7 @@ class Codec:
                     first = False
                 else:
                     buf.write(", ")
-                self.dump_arson(x, buf, transform)
+                self.dump_arson(x, buf, transform, refs)
             buf.write(']')
         elif isinstance(obj, set):
             buf.write('@set [')
@@ -656,7 +1285,7 @@ class Codec:
                     first = False
                 else:
                     buf.write(", ")
-                self.dump_arson(x, buf, transform)
+                self.dump_arson(x, buf, transform, refs)
             buf.write(']')
         elif isinstance(obj, OrderedDict): # must be before dict
             buf.write('{')
@@ -666,9 +1295,9 @@ class Codec:
                     first = False
                 else:
                     buf.write(", ")
-                self.dump_arson(k, buf, transform)
+                self.dump_arson(k, buf, transform, refs)
                 buf.write(": ")
-                self.dump_arson(v, buf, transform)
+                self.dump_arson(v, buf, transform, refs)
             buf.write('}')
         elif isinstance(obj, dict): # if dict is pre 3.7, then no order preserving
             buf.write('@dict {')
@@ -678,9 +1307,9 @@ class Codec:
                     first = False
                 else:
                     buf.write(", ")
-                self.dump_arson(k, buf, transform)
+                self.dump_arson(k, buf, transform, refs)
                 buf.write(": ")
-                self.dump_arson(obj[k], buf, transform)
+                self.dump_arson(obj[k], buf, transform, refs)
             buf.write('}')
         elif isinstance(obj, datetime):
             buf.write('@datetime "{}"'.format(format_datetime(obj)))
@@ -692,15 +1321,654 @@ class Codec:
             if not isinstance(value, OrderedDict) and isinstance(value, dict):
                 value = OrderedDict(value)
             buf.write('@{} '.format(name))
-            self.dump_arson(value, buf, transform)  # XXX: prevent @foo @foo
+            self.dump_arson(value, buf, transform, refs)  # XXX: prevent @foo @foo
+
+# Columnar lists of records
+
+class Columns:
+    """A list of records with the same keys, stored a column at a time
+
+    Used by parse(buf, columnar=True). Columns of ints or floats are kept
+    in an array.array, and records are rebuilt as dicts on access. The
+    list_hook is not called on Columns, only on the lists kept as lists.
+    """
+
+    def __init__(self, keys=None, columns=None, length=0):
+        self.keys = keys
+        self.columns = columns
+        self.length = length
+
+    def append(self, record):
+        """Add a record, or return False if it has different keys"""
+        if type(record) is not dict:
+            return False
+        if self.keys is None:
+            self.keys = tuple(record)
+            self.columns = [self.new_column(v) for v in record.values()]
+            self.length = 1
+            return True
+        if len(record) != len(self.keys) or tuple(record) != self.keys:
+            return False
+
+        columns = self.columns
+        for n, v in enumerate(record.values()):
+            column = columns[n]
+            if type(column) is list:
+                column.append(v)
+            elif column.typecode == 'd' and type(v) is float:
+                column.append(v)
+            elif column.typecode == 'q' and type(v) is int and -2**63 <= v < 2**63:
+                column.append(v)
+            else:
+                column = columns[n] = column.tolist()
+                column.append(v)
+        self.length += 1
+        return True
+
+    def new_column(self, v):
+        from array import array
+        if type(v) is float:
+            return array('d', [v])
+        elif type(v) is int and -2**63 <= v < 2**63:
+            return array('q', [v])
+        return [v]
+
+    def column(self, key):
+        return self.columns[self.keys.index(key)]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(self.length))]
+        if n < 0:
+            n += self.length
+        if not 0 <= n < self.length:
+            raise IndexError(n)
+        return dict(zip(self.keys, [c[n] for c in self.columns]))
+
+    def __iter__(self):
+        keys = self.keys
+        for n in range(self.length):
+            yield dict(zip(keys, [c[n] for c in self.columns]))
+
+    def __eq__(self, other):
+        if isinstance(other, Columns):
+            other = list(other)
+        return list(self) == other
+
+    def __repr__(self):
+        return "Columns({!r}, length={})".format(self.keys, self.length)
+
+# Parallel parsing
+
+def split_list(buf, chunk_size):
+    """Find where to cut a top level list into chunks of whole items
+
+    Returns a list of (start, end) spans, split at the first top level comma
+    after every chunk_size characters, or None if buf isn't a list.
+    """
+    m = whitespace.match(buf, 0)
+    pos = m.end() if m else 0
+    if buf[pos:pos + 1] != '[':
+        return None
+
+    spans = []
+    start = pos = pos + 1
+    target = start + chunk_size
+    depth = 1
+    while True:
+        if depth == 1 and pos >= target:
+            pos = list_skip_comma.match(buf, pos).end()
+        else:
+            pos = list_skip.match(buf, pos).end()
+
+        c = buf[pos:pos + 1]
+        if c == '[' or c == '{':
+            depth += 1
+        elif c == ']' or c == '}':
+            depth -= 1
+            if depth == 0:
+                spans.append((start, pos))
+                return spans
+        elif c == ',':
+            spans.append((start, pos))
+            start = pos + 1
+            target = start + chunk_size
+        else: # end of input, or an unterminated string
+            return None
+        pos += 1
+
+def parse_list_chunk(codec, buf, last, transform=None):
+    out = []
+    pos, end = 0, len(buf)
+
+    limits = codec.check_limits(buf)
+    if limits is not None:
+        limits.depth = 1 # inside the top level list
+
+    m = whitespace.match(buf, pos)
+    if m:
+        pos = m.end()
+
+    while pos < end:
+        item, pos = codec.parse_arson(buf, pos, transform, None, None, limits)
+        out.append(item)
+
+        m = whitespace.match(buf, pos)
+        if m:
+            pos = m.end()
+        if pos == end:
+            break
+        if buf[pos] != ',':
+            raise ParserErr(
+                buf, pos, "Expecting a ',', or a ']' but found {}".format(repr(buf[pos])))
+        pos += 1
+
+        m = whitespace.match(buf, pos)
+        if m:
+            pos = m.end()
+        if pos == end and not last:
+            raise ParserErr(buf, pos, "Expecting an item")
+
+    if not out and not last:
+        raise ParserErr(buf, pos, "Expecting an item")
+    return out, (limits.nodes if limits is not None else 0)
+
+# Shared subtrees
+
+class SharedValues:
+    """Finds the containers that appear more than once inside a value
+
+    Used by dump_arson to write the first occurrence as @define [n, value]
+    and the rest as @ref n. Containers are matched by identity, or by
+    value if by_value is set.
+    """
+
+    container_types = (list, tuple, dict, set)
+
+    def __init__(self, obj, by_value=False):
+        self.by_value = by_value
+        self.keys = {}   # id(container) -> key
+        self.interned = {}  # structure -> key, when by_value
+        self.counts = {}
+        self.ids = {}    # key -> n, assigned while dumping
+        self.active = set()
+        if by_value:
+            self.value_key(obj)
+        self.count(obj)
+
+    def shared_key(self, obj):
+        if isinstance(obj, self.container_types) and obj:
+            key = self.keys.get(id(obj))
+            if key is not None and self.counts.get(key, 0) > 1:
+                return key
+        return None
+
+    def count(self, obj):
+        if not isinstance(obj, self.container_types):
+            return
+        if obj:
+            key = self.keys.setdefault(id(obj), id(obj))
+            n = self.counts[key] = self.counts.get(key, 0) + 1
+            if n > 1:
+                return
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                self.count(k)
+                self.count(v)
+        else:
+            for x in obj:
+                self.count(x)
+
+    def value_key(self, obj):
+        if isinstance(obj, (list, tuple)):
+            if id(obj) in self.keys:
+                return self.keys[id(obj)]
+            structure = ('list', tuple(self.value_key(x) for x in obj))
+        elif isinstance(obj, dict):
+            if id(obj) in self.keys:
+                return self.keys[id(obj)]
+            structure = ('dict', tuple((self.value_key(k), self.value_key(v)) for k, v in obj.items()))
+        elif isinstance(obj, set):
+            if id(obj) in self.keys:
+                return self.keys[id(obj)]
+            structure = ('set', frozenset(self.value_key(x) for x in obj))
+        elif isinstance(obj, float):
+            return (float, obj.hex())
+        elif isinstance(obj, (bytes, bytearray)):
+            return (bytes, bytes(obj))
+        elif isinstance(obj, atomic_types):
+            return (type(obj), obj)
+        else:
+            return (object, id(obj))
+
+        key = self.interned.setdefault(structure, len(self.interned))
+        self.keys[id(obj)] = key
+        return key
+
+# Parse cache
+
+atomic_types = (str, int, float, bool, complex, bytes, type(None), datetime, timedelta)
+
+# memo is keyed by id(), like copy.deepcopy, so values shared by @ref stay shared
+
+def copy_parsed(obj, memo=None):
+    if isinstance(obj, atomic_types):
+        return obj
+    if memo is None:
+        memo = {}
+    elif id(obj) in memo:
+        return memo[id(obj)]
+
+    # anything else, like the results of hooks, is left to deepcopy
+    if type(obj) is list:
+        out = memo[id(obj)] = []
+        out.extend(copy_parsed(x, memo) for x in obj)
+    elif type(obj) is dict:
+        out = memo[id(obj)] = {}
+        for k, v in obj.items():
+            out[k] = copy_parsed(v, memo)
+    elif type(obj) is set:
+        out = memo[id(obj)] = set(obj)  # members are hashable, and so immutable
+    elif type(obj) is bytearray:
+        out = memo[id(obj)] = bytearray(obj)
+    else:
+        import copy
+        out = copy.deepcopy(obj, memo)
+    return out
+
+def freeze_parsed(obj, memo=None):
+    if isinstance(obj, atomic_types):
+        return obj
+    if memo is None:
+        memo = {}
+    elif id(obj) in memo:
+        return memo[id(obj)]
+
+    if isinstance(obj, list):
+        out = tuple(freeze_parsed(x, memo) for x in obj)
+    elif isinstance(obj, dict):
+        from types import MappingProxyType
+        out = MappingProxyType({k: freeze_parsed(v, memo) for k, v in obj.items()})
+    elif isinstance(obj, set):
+        out = frozenset(obj)
+    elif isinstance(obj, bytearray):
+        out = bytes(obj)
+    elif isinstance(obj, Columns):
+        # arrays can't be resized while a memoryview of them exists
+        out = Columns(obj.keys, [tuple(freeze_parsed(x, memo) for x in c) if type(c) is list
+                else memoryview(c).toreadonly() for c in obj.columns], obj.length)
+    else:
+        out = obj
+    memo[id(obj)] = out
+    return out
+
+class ParseCache:
+    """LRU cache of parse results, keyed by a digest of the document
+
+    Use with codec.parse(buf, cache=cache). Results are either deep copied
+    on every hit, or frozen once (lists become tuples, records become
+    read-only mappings, sets become frozensets, bytearrays become bytes)
+    and shared between callers. A frozen cache can't be used with hooks.
+
+    max_bytes limits the total size of the cached documents' source, in
+    bytes of utf-8, not the size of the objects parsed from them. A
+    document larger than max_bytes isn't cached at all.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, frozen=False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.frozen = frozen
+        self.entries = {} # key -> (size, obj), oldest first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        import threading
+        self.lock = threading.Lock()
+
+    def key(self, codec, buf, transform, refs, hooks):
+        """Return the key for a document, and its size in bytes as utf-8"""
+        import hashlib
+        data = buf.encode('utf-8', 'surrogatepass')
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if hooks is not None:
+            hooks = hooks.key()
+        return (codec, transform, bool(refs), hooks, len(data), digest), len(data)
+
+    def parse(self, codec, buf, transform=None, refs=False, hooks=None, try_json=False):
+        if self.frozen and hooks is not None and (hooks.record is not None or hooks.list is not None
+                or hooks.string is not None or hooks.tags):
+            # what a hook returns can't be frozen without changing its type
+            raise ValueError("hooks can't be used with a frozen ParseCache, only columnar")
+        key, size = self.key(codec, buf, transform, refs, hooks)
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            obj = codec.parse_document(buf, transform, refs, hooks, try_json)
+            if self.frozen:
+                obj = freeze_parsed(obj)
+            self.insert(key, size, obj)
+        else:
+            obj = entry[1]
+
+        return obj if self.frozen else copy_parsed(obj)
+
+    def insert(self, key, size, obj):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+            self.entries[key] = (size, obj)
+            self.size += size
+            while self.entries and (len(self.entries) > self.max_entries or
+                    (self.max_bytes is not None and self.size > self.max_bytes)):
+                oldest = next(iter(self.entries))
+                self.size -= self.entries.pop(oldest)[0]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+# Syntax trees
+
+class TreeNode:
+    """A value inside a Document, with its position in the source
+
+    kind is 'record', 'list', or 'value' for anything else. Lists and
+    records can be indexed to get the nodes inside them. Nodes added by
+    set() or append() have no position, and are kept in node.inserted.
+    """
+
+    def __init__(self, doc, kind, tag, start, end=None):
+        self.doc = doc
+        self.kind = kind
+        self.tag = tag
+        self.start = start
+        self.end = end
+        self.parent = None
+        self.key = None      # the key node, inside a record
+        self.key_value = None
+        self.comma = None    # position of the comma after this item
+        self.deleted = False
+        self.new_value = None
+        if kind in ('record', 'list'):
+            self.items = []
+            self.inserted = []
+            self.index = {}
+
+    @property
+    def value(self):
+        if self.start is None:
+            return self.new_value
+        return self.doc.codec.parse(self.text())
+
+    def text(self):
+        if self.start is None:
+            return self.doc.codec.dump(self.new_value)
+        return self.doc.render(self.start, self.end)
+
+    def live(self):
+        return [n for n in self.items if not n.deleted] + self.inserted
+
+    def __len__(self):
+        return len(self.live())
+
+    def __getitem__(self, key):
+        if self.kind == 'record':
+            return self.index[key]
+        elif self.kind == 'list':
+            return self.live()[key]
+        raise TypeError("{} has no items".format(self.kind))
+
+    def keys(self):
+        return [n.key_value for n in self.live()]
+
+    def replace(self, value):
+        """Replace this value, leaving the rest of the source as it was"""
+        self.doc.check(self, replacing=True)
+        edits, tails, old = dict(self.doc.edits), dict(self.doc.tails), self.new_value
+        if self.start is None:
+            self.new_value = value
+        else:
+            self.doc.edit(self.start, self.end, self.doc.codec.dump(value))
+
+        def undo():
+            self.doc.edits, self.doc.tails, self.new_value = edits, tails, old
+        self.doc.check_tags(self.parent, undo)
+
+    def set(self, key, value):
+        if self.kind != 'record':
+            raise TypeError("Can't set a key on {}".format(self.kind))
+        if key in self.index:
+            self.index[key].replace(value)
+        else:
+            self.insert(value, key)
+
+    def append(self, value):
+        if self.kind != 'list':
+            raise TypeError("Can't append to {}".format(self.kind))
+        self.insert(value)
+
+    def insert(self, value, key=None):
+        self.doc.check(self)
+        node = TreeNode(self.doc, 'value', None, None)
+        node.parent = self
+        node.key_value = key
+        node.new_value = value
+        tails = dict(self.doc.tails)
+        self.inserted.append(node)
+        if self.kind == 'record':
+            self.index[key] = node
+        self.doc.tails[self.tail()] = self
+
+        def undo():
+            self.inserted.remove(node)
+            self.index.pop(key, None)
+            self.doc.tails = tails
+        self.doc.check_tags(self, undo)
+
+    def delete(self, key):
+        node = self[key]
+        self.doc.check(node, replacing=True)
+        edits, inserted = dict(self.doc.edits), list(self.inserted)
+
+        def undo():
+            self.doc.edits, self.inserted, node.deleted = edits, inserted, False
+            if self.kind == 'record':
+                self.index[node.key_value] = node
+
+        if self.kind == 'record':
+            del self.index[node.key_value]
+        if node.start is None:
+            self.inserted.remove(node)
+            self.doc.check_tags(self, undo)
+            return
+
+        items = [n for n in self.items if not n.deleted]
+        n = items.index(node)
+        start = node.key.start if node.key is not None else node.start
+        if n + 1 < len(items):
+            after = items[n + 1]
+            self.doc.edit(start, after.key.start if after.key is not None else after.start, '')
+        elif n > 0:
+            # the comma goes too, as the previous item's is deleted along with it
+            self.doc.edit(items[n - 1].end, node.end, '')
+            if node.comma is not None:
+                self.doc.edit(node.comma, node.comma + 1, '')
+        else:
+            self.doc.edit(start, node.end, '')
+            if node.comma is not None and not self.doc.deleted(node.comma):
+                self.doc.edit(node.comma, node.comma + 1, '')
+        node.deleted = True
+        self.doc.check_tags(self, undo)
+
+    def tail(self):
+        """Where inserted items go: after the last item, or the open bracket"""
+        if self.items:
+            return self.items[-1].end
+        return self.doc.buf.index('{' if self.kind == 'record' else '[', self.start) + 1
+
+    def render_tail(self):
+        out = []
+        for node in self.inserted:
+            if node.key_value is not None or self.kind == 'record':
+                out.append("{}: {}".format(self.doc.codec.dump(node.key_value), node.text()))
+            else:
+                out.append(node.text())
+        text = ", ".join(out)
+        if text and any(not n.deleted for n in self.items):
+            text = ", " + text
+        return text
+
+    def __repr__(self):
+        return "<TreeNode {} at {}:{}>".format(self.kind, self.start, self.end)
+
+class Document:
+    """A parsed document that keeps comments, whitespace, and formatting
+
+    Edits to nodes are recorded as (start, end, text) changes to the
+    source, and dump() copies everything else across unchanged.
+    """
+
+    def __init__(self, codec, buf):
+        self.codec = codec
+        self.buf = buf
+        self.root = None
+        self.edits = {}  # (start, end) -> text
+        self.tails = {}  # pos -> node with inserted items
+
+    def parse_node(self, pos):
+        buf = self.buf
+        start = pos
+        tag = None
+        if buf[pos] == '@':
+            m = tag_name.match(buf, pos)
+            tag = buf[pos + 1:m.end()].rstrip()
+            pos = m.end()
+
+        peek = buf[pos]
+        if peek != '{' and peek != '[':
+            value, end = self.codec.parse_arson(buf, start)
+            return TreeNode(self, 'value', tag, start, end), end
+
+        node = TreeNode(self, 'record' if peek == '{' else 'list', tag, start)
+        close = '}' if peek == '{' else ']'
+        pos = self.skip(pos + 1)
+        while buf[pos] != close:
+            key = None
+            if node.kind == 'record':
+                key, pos = self.parse_node(pos)
+                pos = self.skip(self.skip(pos) + 1) # ':'
+            item, pos = self.parse_node(pos)
+            item.parent = node
+            item.key = key
+            pos = self.skip(pos)
+            if buf[pos] == ',':
+                item.comma = pos
+                pos = self.skip(pos + 1)
+            if key is not None:
+                item.key_value = key.value
+                node.index[item.key_value] = item
+            node.items.append(item)
+        node.end = pos + 1
+        return node, node.end
+
+    def skip(self, pos):
+        m = whitespace.match(self.buf, pos)
+        return m.end() if m else pos
+
+    def check(self, node, replacing=False):
+        """Raise ValueError if node, or anything around it, was replaced or deleted
+
+        Only a node that is being replaced again (or deleted) can have had
+        its own span replaced: anything inside it, or added to it, would be lost.
+        """
+        first = node
+        while node is not None:
+            if node.deleted:
+                raise ValueError("{!r} was deleted".format(node))
+            if node.start is not None:
+                for start, end in self.edits:
+                    if start <= node.start and node.end <= end and not (
+                            replacing and node is first and (start, end) == (node.start, node.end)):
+                        raise ValueError("{!r} was replaced".format(node))
+            node = node.parent
+
+    def check_tags(self, node, undo):
+        """Parse each tagged value around an edit again, undoing it if one fails"""
+        while node is not None:
+            if node.tag is not None:
+                try:
+                    self.codec.parse(node.text())
+                except Exception:
+                    undo()
+                    raise
+            node = node.parent
+
+    def deleted(self, pos):
+        return any(start <= pos < end and not text for (start, end), text in self.edits.items())
+
+    def edit(self, start, end, text):
+        for s, e in list(self.edits):
+            if start <= s and e <= end and (s, e) != (start, end):
+                del self.edits[s, e]
+        for pos, node in list(self.tails.items()):
+            if start < pos < end or (start <= node.start and node.end <= end):
+                del self.tails[pos]
+        self.edits[start, end] = text
+
+    def changes(self, start=0, end=None):
+        """The (start, end, text) spans to replace in the source, in order"""
+        if end is None:
+            end = len(self.buf)
+        out = [(s, e, text) for (s, e), text in self.edits.items() if start <= s and e <= end]
+        out.extend((pos, pos, node.render_tail()) for pos, node in self.tails.items()
+                if start < pos < end and node.inserted)
+        out.sort(key=lambda c: (c[0], c[1]))
+        return out
+
+    def render(self, start, end):
+        out = []
+        pos = start
+        for s, e, text in self.changes(start, end):
+            out.append(self.buf[pos:s])
+            out.append(text)
+            pos = e
+        out.append(self.buf[pos:end])
+        return "".join(out)
+
+    def dump(self):
+        return self.render(0, len(self.buf))
 
 codec = Codec(None, None)
 
 parse = codec.parse
+parse_all = codec.parse_all
+parse_tree = codec.parse_tree
 dump = codec.dump
 
 
 def run_tests(parse, dump):
+    import base64
+
     def test_parse(buf, obj):
         out = parse(buf)
 
@@ -0,0 +1,249 @@
+"""python -m arson: validate, format, and convert arson documents
+
+Only sys and arson are imported up front, so that checking a file from a
+shell script doesn't pay for argparse, re, or json. Each input is read as
+a stream of documents, and written out a document at a time.
+"""
+
+import sys
+
+import arson
+
+USAGE = """\
+usage: python -m arson [command] [options] [file ...]
+
+commands:
+  validate     check that every document parses (the default)
+  format       write each document out again, one per line
+  to-json      write each document out as json, one per line
+  from-json    read json documents, and write them out as arson
+
+options:
+  --indent N   indent by N spaces, instead of one document per line
+  --minify     leave out the spaces after ',' and ':'
+  -h, --help   show this message
+
+With no files, or '-', stdin is read. The exit status is 1 if any document
+could not be read or converted, and 2 for bad arguments or missing files.
+"""
+
+commands = ('validate', 'format', 'to-json', 'from-json')
+
+# the strings, brackets, and separators in the output of dump()
+tokens = arson.Regex(r'"(?:[^"\\]|\\[\s\S])*"|[\[\]{}]|, |: |[^"\[\]{},:]+')
+
+class UsageErr(Exception):
+    pass
+
+def parse_args(argv):
+    command = 'validate'
+    indent = None
+    minify = False
+    files = []
+
+    args = list(argv)
+    if args and args[0] in commands:
+        command = args.pop(0)
+    while args:
+        arg = args.pop(0)
+        if arg in ('-h', '--help'):
+            return None
+        elif arg == '--indent' or arg.startswith('--indent='):
+            value = arg[9:] if arg.startswith('--indent=') else (args.pop(0) if args else '')
+            if not value.isdigit():
+                raise UsageErr("--indent needs a number of spaces")
+            indent = int(value)
+        elif arg == '--minify':
+            minify = True
+        elif arg == '--':
+            files.extend(args)
+            break
+        elif arg.startswith('-') and arg != '-':
+            raise UsageErr("unknown option: {}".format(arg))
+        else:
+            files.append(arg)
+    if indent is not None and minify:
+        raise UsageErr("--indent and --minify can't be used together")
+    return command, indent, minify, files or ['-']
+
+def reformat(buf, indent=None, minify=False):
+    """Indent (or minify) the output of dump(), which is all on one line"""
+    if indent is None:
+        if not minify:
+            return buf
+        return "".join(',' if t == ', ' else ':' if t == ': ' else t
+                for t in tokens.findall(buf))
+
+    out = []
+    depth = 0
+    items = tokens.findall(buf)
+    for n, t in enumerate(items):
+        if t == '[' or t == '{':
+            out.append(t)
+            if items[n + 1] != ']' and items[n + 1] != '}':
+                depth += 1
+                out.append('\n' + ' ' * (indent * depth))
+        elif t == ']' or t == '}':
+            if items[n - 1] != '[' and items[n - 1] != '{':
+                depth -= 1
+                out.append('\n' + ' ' * (indent * depth))
+            out.append(t)
+        elif t == ', ':
+            out.append(',\n' + ' ' * (indent * depth))
+        else:
+            out.append(t)
+    return "".join(out)
+
+def check_keys(obj):
+    """Raise TypeError for a key that json.dumps would turn into a string"""
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if not isinstance(key, str):
+                    raise TypeError("keys must be strings, not {}".format(type(key).__name__))
+                stack.append(value)
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+
+class Command:
+    """Runs a command over each input, writing errors to err as file:line:column"""
+
+    def __init__(self, command, indent, minify, out, err):
+        self.command = command
+        self.indent = indent
+        self.minify = minify
+        self.out = out
+        self.err = err
+        self.failed = False
+
+    def error(self, name, where, reason):
+        if where is None:
+            self.err.write("{}: {}\n".format(name, reason))
+        else:
+            self.err.write("{}:{}: {}\n".format(name, where, reason))
+        self.failed = True
+
+    def run(self, name, stream):
+        if self.command == 'from-json':
+            docs = self.read_json(name, stream)
+        else:
+            docs = self.read_arson(name, stream)
+
+        for n, obj in docs:
+            if self.command == 'validate':
+                continue
+            elif self.command == 'to-json':
+                import json
+                try:
+                    check_keys(obj)
+                    text = json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=self.indent,
+                            separators=(',', ':') if self.minify else None)
+                except (TypeError, ValueError) as e:
+                    self.error(name, "document {}".format(n), "can't be written as json: {}".format(e))
+                    continue
+            else:
+                text = reformat(arson.dump(obj, use_json=True), self.indent, self.minify)
+            try:
+                self.out.write(text)
+            except UnicodeEncodeError as e: # a surrogate, from a json escape
+                self.error(name, "document {}".format(n), "can't be written as utf-8: {}".format(e.reason))
+                continue
+            self.out.write('\n')
+
+    def read_arson(self, name, stream):
+        """Yield (n, document) for each document in stream, counting from 1"""
+        errors = []
+        n = 0
+        for obj in arson.codec.parse_stream(stream, errors=errors):
+            for e in errors:
+                self.error(name, "{}:{}".format(e.line, e.column), e.exception.reason)
+            n += len(errors) + 1
+            del errors[:]
+            yield n, obj
+        for e in errors:
+            self.error(name, "{}:{}".format(e.line, e.column), e.exception.reason)
+
+    def read_json(self, name, stream):
+        """Yield (n, document) for each json document, skipping a line after an error
+
+        Duplicate keys are only noted while decoding, so that a document
+        with them is still read to the end before it's rejected.
+        """
+        import json
+        duplicates = []
+
+        def pairs(items):
+            out = dict(items)
+            if len(out) != len(items):
+                duplicates.append(out)
+            return out
+
+        decoder = json.JSONDecoder(object_pairs_hook=pairs)
+        buf = stream.read()  # the json module can't read a stream
+        pos = 0
+        end = len(buf)
+        n = 0
+        while True:
+            while pos < end and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos == end:
+                return
+            n += 1
+            start = pos
+            del duplicates[:]
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                self.error(name, "{}:{}".format(e.lineno, e.colno), e.msg)
+                pos = e.pos
+            else:
+                if duplicates:
+                    line = buf.count('\n', 0, start) + 1
+                    self.error(name, "{}:{}".format(line, start - buf.rfind('\n', 0, start)), "duplicate key")
+                else:
+                    yield n, obj
+                continue
+            nl = buf.find('\n', pos)
+            pos = end if nl == -1 else nl + 1
+
+def main(argv):
+    try:
+        args = parse_args(argv)
+    except UsageErr as e:
+        sys.stderr.write("{}\n\n{}".format(e, USAGE))
+        return 2
+    if args is None:
+        sys.stdout.write(USAGE)
+        return 0
+    command, indent, minify, files = args
+
+    out = open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+    cmd = Command(command, indent, minify, out, sys.stderr)
+    missing = False
+    try:
+        for path in files:
+            if path == '-':
+                name = '<stdin>'
+                stream = open(sys.stdin.fileno(), encoding='utf-8', newline='', closefd=False)
+            else:
+                name = path
+                try:
+                    stream = open(path, encoding='utf-8', newline='')
+                except OSError as e:
+                    sys.stderr.write("{}: {}\n".format(path, e.strerror))
+                    missing = True
+                    continue
+            with stream:
+                try:
+                    cmd.run(name, stream)
+                except UnicodeDecodeError as e:
+                    cmd.error(name, None, "not utf-8: {}".format(e.reason))
+        out.flush()
+    except BrokenPipeError:
+        return 1
+    return 2 if missing else 1 if cmd.failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,689 @@
+"""Differential fuzzing of arson's fast paths against the reference parser
+
+Random documents are written out from the grammar (with mistakes put in
+on purpose), and random objects are made for the dump engines. Each engine
+must give exactly the same answer as Codec.parse_arson or Codec.dump_arson:
+the same values, down to -0.0, NaN, key order, and types, or the same error
+at the same position. parse_tree must dump a document back out unchanged,
+and a random series of edits to it must give the same value as making them
+to the parsed value; parsing with hooks must agree with parsing without.
+Disagreements are shrunk to a small case before they are reported, along
+with how fast each engine was next to the reference.
+
+    python -m tests.fuzz [--seed N] [--cases N] [--engine NAME ...] [--processes]
+"""
+
+import io
+import sys
+import math
+import time
+import random
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import arson
+from arson.__main__ import reformat
+
+codec = arson.codec
+
+# Writing random documents
+
+class DocumentGenerator:
+    """Writes random documents, following the grammar, with some mistakes in"""
+
+    whitespace = ['', '', ' ', '\n', '\t', '  # comment\n', '\r\n', ' #\n ']
+    escapes = ['\\n', '\\t', '\\"', "\\'", '\\\\', '\\/', '\\b', '\\f', '\\r',
+            '\\x41', '\\x7f', '\\u00e9', '\\u2028', '\\ud83d', '\\udc00', '\\U0001F600',
+            '\\U00110000', '\\\n', '\\\r\n', '\\q']
+    chars = ['a', 'b', 'Z', ' ', '0', 'é', ' ', '😀', '\x85', '\x01', '\ud800', '#', ',', ']']
+    tags = ['u8', 'u16', 'i8', 'i64', 'set', 'complex', 'string', 'bytestring', 'base64',
+            'datetime', 'duration', 'float', 'int', 'object', 'dict', 'list', 'bool', 'f32', 'point']
+    typos = list(',:[]{}"\'@#\\\n0x.-_e')
+
+    def __init__(self, rng, max_depth=4, max_items=5, mistakes=0.2, json=False, containers=False):
+        self.rng = rng
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.mistakes = mistakes
+        self.json = json
+        self.containers = containers  # only lists and records at the top
+
+    def document(self):
+        out = self.ws() + self.value(0) + self.ws()
+        if not self.json and self.rng.random() < self.mistakes:
+            out = self.mistake(out)
+        return out
+
+    def ws(self):
+        if self.json:
+            return self.rng.choice(['', ' ', '\n'])
+        return self.rng.choice(self.whitespace)
+
+    def mistake(self, buf):
+        rng = self.rng
+        pos = rng.randrange(len(buf) + 1)
+        kind = rng.randrange(3)
+        if kind == 0:
+            return buf[:pos] + buf[pos + 1:]
+        elif kind == 1:
+            return buf[:pos] + rng.choice(self.typos) + buf[pos:]
+        return buf[:pos] + rng.choice(self.typos) + buf[pos + 1:]
+
+    def value(self, depth):
+        rng = self.rng
+        kinds = ['builtin', 'number', 'number', 'string', 'string']
+        if depth < self.max_depth:
+            kinds += ['list', 'record']
+        if not self.json:
+            kinds += ['tagged']
+        if self.containers and depth == 0:
+            kinds = ['list', 'record']
+        kind = rng.choice(kinds)
+        if kind == 'builtin':
+            return rng.choice(['null', 'true', 'false'])
+        elif kind == 'number':
+            return self.number()
+        elif kind == 'string':
+            return self.string()
+        elif kind == 'list':
+            return self.items('[', ']', [self.value(depth + 1) for _ in range(rng.randrange(self.max_items))])
+        elif kind == 'record':
+            keys = [self.string() for _ in range(rng.randrange(self.max_items))]
+            if keys and rng.random() < 0.1:
+                keys.append(rng.choice(keys))
+            return self.items('{', '}', ["{}{}:{}{}".format(k, self.ws(), self.ws(), self.value(depth + 1))
+                    for k in keys])
+        return self.tagged(depth)
+
+    def items(self, open, close, items):
+        sep = [',' + self.ws() for _ in items]
+        if sep and (self.json or self.rng.random() < 0.7):
+            sep[-1] = ''
+        return open + self.ws() + "".join(i + s for i, s in zip(items, sep)) + self.ws() + close
+
+    def number(self):
+        rng = self.rng
+        sign = rng.choice(['', '', '-'] if self.json else ['', '', '-', '+'])
+        if self.json:
+            return sign + rng.choice([
+                str(rng.randrange(1000)), str(rng.randrange(2**70)), '0.0', '1.5', '1e10',
+                '2.5E-3', '1e400', str(rng.random()),
+            ])
+        return sign + rng.choice([
+            str(rng.randrange(1000)), '007', '1_000', '0x{:x}'.format(rng.randrange(2**70)),
+            '0o17', '0b1010_1010', '0.0', '1.5', '1e10', '2.5E-3', '1_0.5_0', '1e400',
+            str(rng.random()), '0x_1', '1.', '.5', '1e', '0b2',
+        ])
+
+    def string(self):
+        rng = self.rng
+        if self.json:
+            parts = [rng.choice(['a', ' ', 'é', '😀', '\\n', '\\"', '\\u00e9', '\\ud83d\\ude00', '\\/'])
+                    for _ in range(rng.randrange(6))]
+            return '"' + "".join(parts) + '"'
+        quote = rng.choice(['"', "'"])
+        parts = []
+        for _ in range(rng.randrange(6)):
+            if rng.random() < 0.4:
+                parts.append(rng.choice(self.escapes))
+            else:
+                c = rng.choice(self.chars)
+                parts.append(c if c != quote else '\\' + c)
+        return quote + "".join(parts) + quote
+
+    def tagged(self, depth):
+        rng = self.rng
+        tag = rng.choice(self.tags)
+        if tag in ('u8', 'u16', 'i8', 'i64'):
+            lo, hi = arson.number_widths[tag]
+            n = lambda: str(rng.choice([lo, hi, lo - 1, hi + 1, 0, 1, -1]))
+            value = rng.choice([n(), '[{}]'.format(", ".join(n() for _ in range(rng.randrange(4))))])
+        elif tag == 'set':
+            value = self.items('[', ']', [self.number() for _ in range(rng.randrange(4))])
+        elif tag == 'complex':
+            value = '[{}, {}]'.format(self.number(), self.number())
+        elif tag == 'string':
+            value = self.items('[', ']', [self.string() for _ in range(rng.randrange(3))])
+        elif tag == 'bytestring':
+            value = rng.choice(['"abc"', "'\\x00\\xff'", '"\\u00ff"', '"\\u0100"', '"é"'])
+        elif tag == 'base64':
+            value = rng.choice(['"YWJj"', '"YWJ"', '""', '"!!"'])
+        elif tag == 'datetime':
+            value = rng.choice(['"2017-11-22T23:32:07.100497Z"', '"2017-11-22T23:32:07Z"', '"yesterday"'])
+        elif tag == 'float':
+            value = rng.choice(['"nan"', '"NaN"', '"-inf"', '"0x1.8p+1"', '"-0x0.0p+0"', '"1.5"', '1', '-0.0'])
+        elif tag in ('duration', 'int', 'bool', 'f32'):
+            value = rng.choice([self.number(), 'true'])
+        else:
+            value = self.value(depth + 1)
+        return '@{}{}{}'.format(tag, rng.choice([' ', ' ', '  ', '']), value)
+
+class ObjectGenerator:
+    """Makes random objects for the dump engines"""
+
+    floats = [0.0, -0.0, 1.5, -2.5e-300, 1e300, 5e-324, float('inf'), float('-inf'), float('nan')]
+    chars = ['a', ' ', '"', "'", '\\', '\n', '\r', '\x00', '\x1f', '\x7f', '\x85', 'é', ' ', '😀', '/']
+
+    def __init__(self, rng, max_depth=4, max_items=5, surrogates=True):
+        self.rng = rng
+        self.max_depth = max_depth
+        self.max_items = max_items
+        if surrogates:
+            self.chars = self.chars + ['\ud800']
+
+    def value(self, depth=0):
+        rng = self.rng
+        kinds = ['atom', 'atom', 'string', 'string', 'tagged']
+        if depth < self.max_depth:
+            kinds += ['list', 'dict']
+        kind = rng.choice(kinds)
+        if kind == 'atom':
+            return rng.choice([None, True, False, rng.randrange(-2**70, 2**70), rng.randrange(100),
+                rng.choice(self.floats), rng.random()])
+        elif kind == 'string':
+            return self.string()
+        elif kind == 'list':
+            return [self.value(depth + 1) for _ in range(rng.randrange(self.max_items))]
+        elif kind == 'dict':
+            return {self.string(): self.value(depth + 1) for _ in range(rng.randrange(self.max_items))}
+        return rng.choice([
+            lambda: bytes(rng.randrange(256) for _ in range(rng.randrange(5))),
+            lambda: bytearray(b'ab'),
+            lambda: {rng.randrange(5) for _ in range(rng.randrange(4))},
+            lambda: complex(rng.choice(self.floats), 1),
+            lambda: datetime(2017, 11, 22, 23, 32, 7, rng.randrange(10**6), tzinfo=timezone.utc),
+            lambda: timedelta(seconds=rng.randrange(10**6)),
+            lambda: tuple(self.value(depth + 1) for _ in range(2)),
+        ])()
+
+    def string(self):
+        return "".join(self.rng.choice(self.chars) for _ in range(self.rng.randrange(6)))
+
+# Comparing results
+
+def same(a, b):
+    """Equality, but with types, key order, NaN, and the sign of zero too"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, float):
+        if math.isnan(a) or math.isnan(b):
+            return math.isnan(a) and math.isnan(b)
+        return a == b and math.copysign(1, a) == math.copysign(1, b)
+    if isinstance(a, complex):
+        return same(a.real, b.real) and same(a.imag, b.imag)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(same(a[k], b[k]) for k in a)
+    return a == b
+
+def outcome(fn, case):
+    """('ok', value), or ('error', exception type, message)"""
+    try:
+        return ('ok', fn(case))
+    except Exception as e:
+        return ('error', type(e).__name__, str(e))
+
+def agree(expected, actual, positions=True):
+    if expected[0] != actual[0]:
+        return False
+    if expected[0] == 'ok':
+        return same(expected[1], actual[1])
+    return expected[1] == actual[1] and (not positions or expected[2] == actual[2])
+
+# Engines, and their references
+
+def reference_parse(buf):
+    obj, pos = codec.parse_arson(buf, 0)
+    codec.parse_trailing(buf, pos)
+    return obj
+
+def reference_dump(obj):
+    buf = io.StringIO()
+    codec.dump_arson(obj, buf)
+    return buf.getvalue()
+
+def reference_all(buf):
+    errors = []
+    out = codec.parse_all(buf, errors=errors)
+    return out, document_errors(errors)
+
+def document_errors(errors):
+    # parse_stream only keeps the lines it needs, so an exception's own pos
+    # and context are into that, and line, column, and offset have to match
+    return [(e.index, e.line, e.column, e.offset, type(e.exception).__name__,
+        getattr(e.exception, 'reason', str(e.exception)).split(' (context: ')[0]) for e in errors]
+
+def as_list(obj):
+    if isinstance(obj, arson.Columns):
+        return [as_list(x) for x in obj]
+    if type(obj) is list:
+        return [as_list(x) for x in obj]
+    if type(obj) is dict:
+        return {k: as_list(v) for k, v in obj.items()}
+    return obj
+
+def parse_twice_cached(buf):
+    cache = arson.ParseCache()
+    return [codec.parse(buf, cache=cache), codec.parse(buf, cache=cache)]
+
+def parse_chunked(buf):
+    # small chunks, so that even short lists are cut up, but no more than
+    # eight or so of them for the benchmarks
+    return codec.parse_parallel(buf, workers=2, chunk_size=max(8, len(buf) // 8))
+
+def parse_stream(buf):
+    errors = []
+    out = list(codec.parse_stream(io.StringIO(buf), errors=errors, chunk_size=7))
+    return out, document_errors(errors)
+
+def round_trip_refs(obj):
+    return codec.parse(codec.dump(obj, refs=True), refs=True)
+
+def round_trip_format(obj):
+    buf = reformat(codec.dump(obj), indent=2)
+    return codec.parse(buf)
+
+# parse_tree, and editing a Document
+
+def parse_tree(buf):
+    """The value of parse_tree(buf), which must dump back out as it was"""
+    doc = codec.parse_tree(buf)
+    if doc.dump() != buf:
+        raise AssertionError("dump() changed the document: {!r}".format(doc.dump()))
+    value = doc.root.value
+    check_tree(doc.root, value)
+    return value
+
+def check_tree(node, obj):
+    """Check that the nodes of lists and records line up with the parsed value"""
+    if node.kind == 'list' and type(obj) is list:
+        if len(node) != len(obj):
+            raise AssertionError("{!r} has {} items, not {}".format(node, len(node), len(obj)))
+        for n, x in enumerate(obj):
+            check_tree(node[n], x)
+    elif node.kind == 'record' and type(obj) is dict:
+        if node.keys() != list(obj):
+            raise AssertionError("{!r} has keys {!r}, not {!r}".format(node, node.keys(), list(obj)))
+        for k, v in obj.items():
+            check_tree(node[k], v)
+
+edit_values = [0, -1, 2.5, -0.0, 'x', "it's", None, True, [1, 'a'], {'k': [2]}, {}]
+
+def edit_both(buf):
+    """Make the same random edits to a Document, and to the value parsed from it
+
+    The edits are chosen by a Random seeded with buf, so they're the same
+    for each call. Returns the Document, the edited value, and the error
+    from the Document if an edit failed.
+    """
+    doc = codec.parse_tree(buf)
+    model = reference_parse(buf)
+    rng = random.Random(buf)
+    replaced = set()
+
+    def editable(node, obj):
+        # tagged values can have rules of their own, like @u8 or @set
+        return (node.kind in ('list', 'record') and node.tag is None and id(node) not in replaced
+                and type(obj) in (list, dict))
+
+    for _ in range(rng.randrange(1, 9)):
+        node, obj, parent = doc.root, model, None
+        for step in [rng.randrange(8) for _ in range(4)]:
+            if not editable(node, obj) or step % (len(obj) + 1) == len(obj):
+                break
+            key = list(obj)[step % len(obj)] if type(obj) is dict else step % len(obj)
+            parent = (node, obj, key)
+            node, obj = node[key], obj[key]
+
+        op = rng.choice(['replace', 'delete', 'clear', 'insert'])
+        value = rng.choice(edit_values)
+        copy = codec.parse(codec.dump(value))
+        try:
+            if op == 'replace':
+                node.replace(value)
+                replaced.add(id(node))
+                if parent is None:
+                    model = copy
+                else:
+                    parent[1][parent[2]] = copy
+            elif op == 'delete' and parent is not None:
+                parent[0].delete(parent[2])
+                del parent[1][parent[2]]
+            elif op == 'clear' and editable(node, obj):
+                # from the last item back, so each one deleted is the last
+                for key in reversed(list(obj) if type(obj) is dict else range(len(obj))):
+                    node.delete(key)
+                    del obj[key]
+            elif op == 'insert' and editable(node, obj):
+                if type(obj) is list:
+                    node.append(value)
+                    obj.append(copy)
+                else:
+                    key = rng.choice(['a', 'b', 'new'])
+                    if key in node.index:
+                        replaced.add(id(node.index[key]))
+                    node.set(key, value)
+                    obj[key] = copy
+        except Exception as e:
+            return doc, model, e
+    return doc, model, None
+
+def edit_tree(buf):
+    doc, model, error = edit_both(buf)
+    if error is not None:
+        raise error
+    value = codec.parse(doc.dump())
+    if not same(doc.root.value, value):
+        raise AssertionError("root.value is {!r}, not {!r}".format(doc.root.value, value))
+    return value
+
+def edit_model(buf):
+    return edit_both(buf)[1]
+
+# Hooks
+
+class Record(dict):
+    pass
+
+class List(list):
+    pass
+
+class Str(str):
+    pass
+
+def point(value):
+    # the tagged value itself doesn't go through record_hook or list_hook
+    return ('point', Record(value) if type(value) is dict else List(value) if type(value) is list else value)
+
+def tagged_to_object(name, value):
+    if name == 'point':
+        return ('point', value)
+    raise NotImplementedError(name)
+
+tagged_codec = arson.Codec(None, tagged_to_object)
+
+def unhook(obj):
+    """Turn what the hooks made back into dicts, lists, and strings
+
+    Every record and list should have been through a hook, so a plain
+    one is an error, apart from lists tagged with a fixed width, like @u8.
+    """
+    if type(obj) is dict or (type(obj) is list and not all(type(x) is int for x in obj)):
+        raise AssertionError("a hook wasn't called on {!r}".format(obj))
+    if type(obj) is list:
+        return obj
+    if type(obj) is Record:
+        return {unhook(k): unhook(v) for k, v in obj.items()}
+    if type(obj) is List:
+        return [unhook(x) for x in obj]
+    if type(obj) is Str:
+        return str(obj)
+    if type(obj) is set:
+        return {unhook(x) for x in obj}
+    if type(obj) is tuple:
+        return tuple(unhook(x) for x in obj)
+    return obj
+
+def parse_hooked(buf):
+    cache = arson.ParseCache()
+    hooks = dict(record_hook=Record, list_hook=List, string_hook=Str, tag_hooks={'point': point})
+    return [unhook(tagged_codec.parse(buf, cache=cache, **hooks)) for _ in range(2)]
+
+def reference_tagged(buf):
+    obj, pos = tagged_codec.parse_arson(buf, 0)
+    tagged_codec.parse_trailing(buf, pos)
+    return obj
+
+class Engine:
+    """A fast path to check, with the reference it has to agree with
+
+    kind is 'parse' (cases are documents), 'edit' (documents with a list or
+    record at the top, without mistakes put in), or 'dump' (cases are objects),
+    and expect turns the reference's value into the one the engine should
+    give. Without positions, errors only need to be of the same type.
+    """
+
+    def __init__(self, name, kind, run, reference, expect=None, positions=True):
+        self.name = name
+        self.kind = kind
+        self.run = run
+        self.reference = reference
+        self.expect = expect
+        self.positions = positions
+
+    def check(self, case):
+        """Return the reference's and the engine's outcomes, and if they agree"""
+        expected = outcome(self.reference, case)
+        if expected[0] == 'ok' and self.expect is not None:
+            expected = ('ok', self.expect(expected[1]))
+        actual = outcome(self.run, case)
+        return expected, actual, agree(expected, actual, self.positions)
+
+engines = [
+    Engine('try_json', 'parse', lambda buf: codec.parse(buf, try_json=True), reference_parse),
+    Engine('columnar', 'parse', lambda buf: as_list(codec.parse(buf, columnar=True)), reference_parse),
+    Engine('cache', 'parse', parse_twice_cached, reference_parse, expect=lambda obj: [obj, obj]),
+    Engine('parallel', 'parse', parse_chunked, reference_parse),
+    Engine('stream', 'parse', parse_stream, reference_all),
+    Engine('tree', 'parse', parse_tree, reference_parse),
+    Engine('edits', 'edit', edit_tree, edit_model),
+    Engine('hooks', 'parse', parse_hooked, reference_tagged, expect=lambda obj: [obj, obj]),
+    Engine('use_json', 'dump', lambda obj: codec.dump(obj, use_json=True), reference_dump),
+    Engine('refs', 'dump', round_trip_refs, lambda obj: reference_parse(reference_dump(obj)), positions=False),
+    Engine('format', 'dump', round_trip_format, lambda obj: reference_parse(reference_dump(obj)), positions=False),
+]
+
+# Shrinking failures
+
+def shrink_text(buf, fails):
+    """Delete runs of characters, halving their length, while the case still fails"""
+    n = 2
+    while len(buf) > 1:
+        size = max(1, len(buf) // n)
+        for i in range(0, len(buf), size):
+            smaller = buf[:i] + buf[i + size:]
+            if fails(smaller):
+                buf = smaller
+                n = max(2, n - 1)
+                break
+        else:
+            if size == 1:
+                break
+            n = min(len(buf), n * 2)
+    return buf
+
+def smaller_objects(obj):
+    if isinstance(obj, (list, tuple)):
+        for i, x in enumerate(obj):
+            yield x
+            yield type(obj)(obj[:i]) + type(obj)(obj[i + 1:])
+        for i, x in enumerate(obj):
+            for y in smaller_objects(x):
+                yield type(obj)(obj[:i]) + type(obj)([y]) + type(obj)(obj[i + 1:])
+    elif isinstance(obj, dict):
+        for k in obj:
+            yield obj[k]
+            yield {j: v for j, v in obj.items() if j != k}
+        for k in obj:
+            for y in smaller_objects(obj[k]):
+                yield {j: (y if j == k else v) for j, v in obj.items()}
+    elif isinstance(obj, str) and obj:
+        yield obj[:len(obj) // 2]
+        yield obj[len(obj) // 2:]
+        for i in range(len(obj)):
+            yield obj[:i] + obj[i + 1:]
+    elif isinstance(obj, (bytes, bytearray, set)) and obj:
+        yield type(obj)()
+    elif isinstance(obj, int) and not isinstance(obj, bool) and obj not in (0, 1):
+        yield 0
+        yield 1
+
+def shrink_object(obj, fails):
+    """Swap the object for a smaller one that still fails, until none do"""
+    while True:
+        for smaller in smaller_objects(obj):
+            if fails(smaller):
+                obj = smaller
+                break
+        else:
+            return obj
+
+# Running
+
+class Report:
+    def __init__(self):
+        self.cases = {}      # engine name -> number of cases
+        self.failures = []   # (engine name, case, expected, actual)
+        self.timings = {}    # engine name -> (bytes, reference seconds, engine seconds)
+
+    def __str__(self):
+        lines = ["{:10} {:>6} {:>8} {:>12} {:>12} {:>7}".format(
+                'engine', 'cases', 'failed', 'ref MB/s', 'MB/s', 'ratio')]
+        for name, cases in self.cases.items():
+            failed = sum(1 for f in self.failures if f[0] == name)
+            size, ref, fast = self.timings.get(name, (0, 0, 0))
+            lines.append("{:10} {:>6} {:>8} {:>12.2f} {:>12.2f} {:>6.2f}x".format(
+                name, cases, failed, size / ref / 1e6 if ref else 0,
+                size / fast / 1e6 if fast else 0, ref / fast if fast else 0))
+        for name, case, expected, actual in self.failures:
+            lines.append("")
+            lines.append("{}: {!r}".format(name, case))
+            lines.append("  reference: {!r}".format(expected))
+            lines.append("  {}: {!r}".format(name, actual))
+        return "\n".join(lines)
+
+def run(seed=0, cases=500, names=None, processes=False, bench_size=200000):
+    """Run each engine over the same random cases, and time them on large ones"""
+    report = Report()
+    selected = [e for e in engines if names is None or e.name in names]
+    rng = random.Random(seed)
+    documents = DocumentGenerator(rng)
+    objects = ObjectGenerator(rng)
+    valid = DocumentGenerator(rng, mistakes=0, containers=True)
+    corpus = {
+        'parse': [documents.document() for _ in range(cases)],
+        'edit': valid_documents(valid, cases),
+        'dump': [objects.value() for _ in range(cases)],
+    }
+
+    with pool(processes):
+        for engine in selected:
+            report.cases[engine.name] = 0
+            for case in corpus[engine.kind]:
+                report.cases[engine.name] += 1
+                expected, actual, ok = engine.check(case)
+                if not ok:
+                    fails = lambda c: not engine.check(c)[2]
+                    if engine.kind != 'dump':
+                        case = shrink_text(case, fails)
+                    else:
+                        case = shrink_object(case, fails)
+                    expected, actual, _ = engine.check(case)
+                    report.failures.append((engine.name, case, expected, actual))
+
+        if bench_size:
+            bench = benchmarks(random.Random(seed), bench_size)
+            for engine in selected:
+                case, size = bench[engine.name]
+                report.timings[engine.name] = (size, timed(engine.reference, case), timed(engine.run, case))
+    return report
+
+def benchmarks(rng, size):
+    """A large, valid case for each engine, along with its size in bytes"""
+    json_docs = DocumentGenerator(rng, max_depth=3, json=True)
+    arson_docs = DocumentGenerator(rng, max_depth=3, mistakes=0)
+    json_buf = '[' + ", ".join(d for d in iter_until(json_docs.document, size) if ok(d)) + ']'
+    arson_buf = '[' + ", ".join(d for d in iter_until(arson_docs.document, size) if ok(d)) + ']'
+    rows = '[' + ", ".join('{{"ts": {}, "host": "h{}", "value": {}}}'.format(i, i % 7, i * 0.5)
+            for i in range(size // 40)) + ']'
+    many = "\n".join(d for d in iter_until(arson_docs.document, size) if ok(d))
+    objects = ObjectGenerator(rng, max_depth=3, surrogates=False)
+    data = [objects.value() for _ in range(size // 100)]
+    untagged = [{"id": i, "name": "n{}".format(i), "tags": ["a", "b"], "v": None} for i in range(size // 50)]
+
+    def sized(case):
+        text = case if isinstance(case, str) else reference_dump(case)
+        return case, len(text.encode('utf-8', 'surrogatepass'))
+
+    return {
+        'try_json': sized(json_buf),
+        'columnar': sized(rows),
+        'cache': sized(arson_buf),
+        'parallel': sized(arson_buf),
+        'stream': sized(many),
+        'tree': sized(arson_buf),
+        'edits': sized(arson_buf),
+        'hooks': sized(arson_buf),
+        'use_json': sized(untagged),
+        'refs': sized(data),
+        'format': sized(data),
+    }
+
+def valid_documents(generator, n):
+    out = []
+    while len(out) < n:
+        buf = generator.document()
+        if ok(buf):
+            out.append(buf)
+    return out
+
+def iter_until(make, size):
+    total = 0
+    while total < size:
+        out = make()
+        total += len(out)
+        yield out
+
+def ok(buf):
+    return outcome(reference_parse, buf)[0] == 'ok'
+
+def timed(fn, case, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            fn(case)
+        except Exception:
+            pass
+        end = time.perf_counter() - start
+        best = end if best is None else min(best, end)
+    return best
+
+class pool:
+    """Run parse_parallel's chunks in threads, unless asked for processes"""
+
+    def __init__(self, processes):
+        self.patch = None if processes else mock.patch(
+                'concurrent.futures.ProcessPoolExecutor', thread_pool)
+
+    def __enter__(self):
+        if self.patch is not None:
+            self.patch.start()
+
+    def __exit__(self, *exc):
+        if self.patch is not None:
+            self.patch.stop()
+
+def thread_pool(workers=None):
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(workers)
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m tests.fuzz', description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cases', type=int, default=1000)
+    parser.add_argument('--engine', action='append', choices=[e.name for e in engines])
+    parser.add_argument('--processes', action='store_true', help="use a real process pool for parallel")
+    parser.add_argument('--bench-size', type=int, default=1000000, help="bytes per benchmark case")
+    args = parser.parse_args(argv)
+
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print("seed {}".format(seed))
+    report = run(seed, args.cases, args.engine, args.processes, args.bench_size)
+    print(report)
+    return 1 if report.failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
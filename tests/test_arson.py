@@ -1,4 +1,10 @@
+import os
+import io
+import sys
+import tempfile
+import subprocess
 import unittest
+from unittest import mock
 import base64
 from datetime import datetime, timedelta, timezone
 import arson
@@ -37,6 +43,8 @@ class ArsonTest(unittest.TestCase):
 b"
         """, "ab")
         self.assertParse("0.0", 0.0)
+        self.assertParse("1e10", 1e10)
+        self.assertParse("1.5E-3", 1.5e-3)
         self.assertParse("-0.0", -0.0)
         self.assertParse("'foo'", "foo")
         self.assertParse(r"'fo\no'", "fo\no")
@@ -89,6 +97,452 @@ b"
         for t in tests:
             self.assertRoundTrip(t)
 
+    def test_parse_cache(self):
+        cache = arson.ParseCache(max_entries=2)
+        buf = "{'a': [1, 2, 3], 'b': @set [1]}"
+        obj0 = arson.parse(buf, cache=cache)
+        obj0['a'].append(4)
+        obj1 = arson.parse(buf, cache=cache)
+        self.assertEqual(obj1, {'a': [1, 2, 3], 'b': {1}})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        arson.parse("1", cache=cache)
+        arson.parse("2", cache=cache)
+        self.assertEqual(len(cache), 2)
+        arson.parse(buf, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+        cache = arson.ParseCache(max_bytes=len(buf), frozen=True)
+        obj0 = arson.parse(buf, cache=cache)
+        self.assertEqual(obj0['a'], (1, 2, 3))
+        with self.assertRaises(TypeError):
+            obj0['c'] = 1
+        self.assertIs(arson.parse(buf, cache=cache), obj0)
+        arson.parse("[1]", cache=cache)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 3)
+
+        # sizes are bytes of utf-8, not characters
+        cache = arson.ParseCache(max_bytes=8)
+        arson.parse("'ééé'", cache=cache)
+        self.assertEqual(cache.size, 8)
+        arson.parse("'éééé'", cache=cache)
+        self.assertEqual((len(cache), cache.size), (1, 8))
+
+    def test_refs(self):
+        addr = {"street": "1 Main St", "city": "Springfield"}
+        doc = [{"home": addr, "work": addr}, addr, [1, 2], [1, 2]]
+
+        buf = arson.dump(doc, refs=True)
+        self.assertEqual(buf.count("@define"), 1)
+        self.assertEqual(buf.count("@ref"), 2)
+        out = arson.parse(buf, refs=True)
+        self.assertEqual(out, doc)
+        self.assertIs(out[0]["home"], out[1])
+
+        out = arson.parse(arson.dump(doc, refs='value'), refs=True)
+        self.assertEqual(out, doc)
+        self.assertIs(out[2], out[3])
+
+        for cache in (arson.ParseCache(), arson.ParseCache(frozen=True)):
+            for _ in range(2):
+                out = arson.parse(buf, refs=True, cache=cache)
+                self.assertIs(out[0]["home"], out[1])
+                self.assertIs(out[0]["work"], out[1])
+
+        with self.assertRaises(arson.ParserErr):
+            arson.parse("@ref 0", refs=True)
+        with self.assertRaises(arson.SemanticErr):
+            arson.parse("[@define [0, [1]], @define [0, [2]]]", refs=True)
+
+    def test_parse_hooks(self):
+        class Record(dict):
+            pass
+
+        out = arson.parse("{'a': [1, 'x'], 'b': @set [1], 'c': @duration 60}",
+            record_hook=Record,
+            list_hook=tuple,
+            string_hook=str.upper,
+            tag_hooks={'duration': lambda v: v * 2},
+        )
+        self.assertIsInstance(out, Record)
+        self.assertEqual(out, {'A': (1, 'X'), 'B': {1}, 'C': 120})
+
+        out = arson.parse("@point [1, 2]", tag_hooks={'point': tuple})
+        self.assertEqual(out, (1, 2))
+
+        cache = arson.ParseCache()
+        for _ in range(2):
+            out = arson.parse("{'a': {'b': [1]}}", cache=cache, record_hook=Record)
+            self.assertIsInstance(out, Record)
+            self.assertIsInstance(out['a'], Record)
+            self.assertEqual(out, {'a': {'b': [1]}})
+
+        cache = arson.ParseCache(frozen=True)
+        for hooks in (dict(list_hook=tuple), dict(record_hook=Record), dict(tag_hooks={'p': tuple})):
+            with self.assertRaises(ValueError):
+                arson.parse("[{'a': 1}]", cache=cache, **hooks)
+        self.assertEqual(len(cache), 0)
+
+    def test_parse_all(self):
+        self.assertEqual(arson.parse_all("1 [2] # three\n{'four': 4}\n"), [1, [2], {'four': 4}])
+        self.assertEqual(arson.parse_all(""), [])
+
+        buf = "{'a': 1}\n{'a': 1, 'a': 2}\n[1,\n  2]\n[1, 2\n'ok'\n"
+        with self.assertRaises(arson.SemanticErr):
+            arson.parse_all(buf)
+
+        errors = []
+        self.assertEqual(arson.parse_all(buf, errors=errors), [{'a': 1}, [1, 2], 'ok'])
+        self.assertEqual([e.index for e in errors], [1, 3])
+        self.assertIsInstance(errors[0].exception, arson.SemanticErr)
+        self.assertEqual((errors[0].line, errors[0].start), (2, 9))
+        self.assertIsInstance(errors[1].exception, arson.ParserErr)
+        self.assertEqual((errors[1].line, errors[1].column), (6, 1))
+
+        errors = []
+        self.assertEqual(arson.parse_all("'\u00e9' [1,", errors=errors), ['\u00e9'])
+        self.assertEqual(errors[0].pos, 7)
+        self.assertEqual(errors[0].offset, 8)
+
+        errors = []
+        buf = "{\n'a': 1,\n'b': ?\n}\n[2]\n"
+        self.assertEqual(arson.parse_all(buf, errors=errors), [[2]])
+        self.assertEqual([(e.index, e.line) for e in errors], [(0, 3)])
+
+        # tags that can't be converted are errors too, at the tag
+        errors = []
+        buf = "[1]\n@complex [1, 2, 3]\n[@string [1]]\n@foo 1\n{[1]: 2}\n'\\U00110000'\n[2]\n"
+        self.assertEqual(arson.parse_all(buf, errors=errors), [[1], [2]])
+        self.assertEqual([(e.index, e.line, e.column) for e in errors],
+                [(1, 2, 1), (2, 3, 2), (3, 4, 1), (4, 5, 5), (5, 6, 2)])
+        self.assertTrue(all(isinstance(e.exception, (arson.ParserErr, arson.SemanticErr)) for e in errors))
+        self.assertEqual(errors[2].exception.reason, "Unknown tag: @foo")
+
+        codec = arson.Codec(None, None, arson.Limits(max_size=10))
+        self.assertEqual(codec.parse_all("[1]\n[2]\n[3]\n[4]\n"), [[1], [2], [3], [4]])
+        errors = []
+        self.assertEqual(codec.parse_all("[1]\n'" + "x" * 100 + "'\n[2]", errors=errors), [[1], [2]])
+        self.assertEqual([(e.index, e.line, e.exception.limit) for e in errors], [(1, 2, "max_size")])
+
+    def test_parse_parallel(self):
+        items = [{"n": i, "s": "a, ]} # [{", "l": [i, i + 1]} for i in range(100)]
+        buf = "# header\n" + arson.dump(items)
+        self.assertEqual(arson.split_list(buf, 1)[0][0], 10)
+        spans = arson.split_list(buf, 200)
+        self.assertGreater(len(spans), 1)
+        self.assertTrue(all(hi - lo >= 200 for lo, hi in spans[:-1]))
+        self.assertEqual(spans[-1][1], len(buf) - 1)
+        self.assertEqual(arson.codec.parse_parallel(buf, workers=2, chunk_size=200), items)
+        self.assertEqual(arson.codec.parse_parallel("[1, 2, 3, ]", chunk_size=1), [1, 2, 3])
+        self.assertEqual(arson.codec.parse_parallel("@set [1, 2]", chunk_size=1), {1, 2})
+
+        for bad in ("[1, 2,, 3]", "[1, 2 3]", "[1, 2, 'x] 3", "[1, {'a': 1, 'a': 2}, 3]"):
+            with self.assertRaises(Exception) as expected:
+                arson.parse(bad)
+            with self.assertRaises(type(expected.exception)) as actual:
+                arson.codec.parse_parallel(bad, chunk_size=1)
+            self.assertEqual(str(actual.exception), str(expected.exception))
+
+    def test_parse_try_json(self):
+        buf = '{"a": [1, -0.0, 1e10, "\\u00e9", true, null], "b": {}}'
+        self.assertEqual(arson.parse(buf, try_json=True), arson.parse(buf))
+        self.assertEqual(arson.parse("{'a': [1,],} # arson", try_json=True), {'a': [1]})
+        self.assertEqual(arson.parse("@set [1]", try_json=True), {1})
+
+        for bad in ('{"a": 1, "a": 2}', 'NaN', '-Infinity', r'"\ud83d\ude00"', r'"\udc28"', '"\x85"'):
+            with self.assertRaises(Exception) as expected:
+                arson.parse(bad)
+            with self.assertRaises(type(expected.exception)) as actual:
+                arson.parse(bad, try_json=True)
+            self.assertEqual(str(actual.exception), str(expected.exception))
+
+        cache = arson.ParseCache()
+        arson.load_json()
+        with mock.patch.object(arson, 'json_decoder', wraps=arson.json_decoder) as decoder:
+            self.assertEqual(arson.parse(buf, try_json=True, cache=cache), arson.parse(buf))
+            self.assertEqual(decoder.decode.call_count, 1)
+
+    def test_dump_use_json(self):
+        tests = [
+            1, -0.0, 1.5, "a'b\"c\\u0001\x01\n\x85", None, True,
+            float('nan'), float('inf'), -float('inf'),
+            [1, [2, b"3"], (4, 5), 6], {"a": {"b": set([1])}, 1: 2, "c": "d"},
+            {"a": [], "b": {}, "c": (), "d": timedelta(seconds=1)},
+            [datetime.now().astimezone(timezone.utc), 1 + 2j, bytearray(b"x")],
+        ]
+        for obj in tests:
+            self.assertEqual(arson.dump(obj, use_json=True), arson.dump(obj))
+
+    def test_parse_columnar(self):
+        rows = [{"ts": i, "host": "h{}".format(i), "value": i * 1.5} for i in range(10)]
+        buf = arson.dump(rows)
+        out = arson.parse(buf, columnar=True)
+        self.assertIsInstance(out, arson.Columns)
+        self.assertEqual(out.keys, ("ts", "host", "value"))
+        self.assertEqual(out.column("ts").typecode, 'q')
+        self.assertEqual(out.column("value").typecode, 'd')
+        self.assertEqual(out.column("host"), [r["host"] for r in rows])
+        self.assertEqual(out[3], rows[3])
+        self.assertEqual(out[-1], rows[-1])
+        self.assertEqual(out[1:3], rows[1:3])
+        self.assertEqual(out, rows)
+        self.assertEqual(arson.dump(out), buf)
+
+        out = arson.parse("[{'a': 1}, {'a': 2.5}, {'a': 18446744073709551616}]", columnar=True)
+        self.assertEqual(out.column("a"), [1, 2.5, 2**64])
+
+        for buf in ("[{'a': 1}]", "[{'a': 1}, {'b': 1}]", "[{'a': 1}, 2]", "@set [1, 2]"):
+            out = arson.parse(buf, columnar=True)
+            self.assertNotIsInstance(out, arson.Columns)
+            self.assertEqual(out, arson.parse(buf))
+
+        cache = arson.ParseCache(frozen=True)
+        out = arson.parse("[{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}]", columnar=True, cache=cache)
+        with self.assertRaises((AttributeError, TypeError)):
+            out.column('a').append(5)
+        with self.assertRaises((AttributeError, TypeError)):
+            out.column('b').append('z')
+        self.assertEqual(out, [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}])
+        self.assertEqual(arson.parse("[{'a': 1}, {'a': 2}]", columnar=True, list_hook=tuple),
+                arson.Columns(('a',), [[1, 2]], 2))
+
+    def test_limits(self):
+        def codec(**limits):
+            return arson.Codec(None, None, arson.Limits(**limits))
+
+        tests = [
+            ("[1, 2, 3]", dict(max_size=8), "max_size", 8),
+            ("[[[1]], 2]", dict(max_depth=2), "max_depth", 2),
+            ("{'a': {'b': {}}}", dict(max_depth=2), "max_depth", 12),
+            ("['ab', 'abcd']", dict(max_string=3), "max_string", 7),
+            ("@bytestring 'abcd'", dict(max_string=3), "max_string", 12),
+            ("[1, -0x1234]", dict(max_digits=5), "max_digits", 5),
+            ("[1, 1.234e5]", dict(max_digits=5), "max_digits", 4),
+            ("[1, 2, 3]", dict(max_items=2), "max_items", 7),
+            ("{'a': 1, 'b': 2}", dict(max_items=1), "max_items", 9),
+            ("[1, [2, 3]]", dict(max_nodes=4), "max_nodes", 8),
+        ]
+        for buf, limits, name, pos in tests:
+            with self.assertRaises(arson.LimitErr) as err:
+                codec(**limits).parse(buf)
+            self.assertEqual((err.exception.limit, err.exception.pos), (name, pos))
+
+        # long strings are found without reading them to the end
+        big = "'" + "x" * 5000000 + "'"
+        for buf in (big, "['ab\\x41']", "['ab" + "\\\n" * 5 + "']"):
+            with self.assertRaises(arson.LimitErr) as err:
+                codec(max_string=3).parse(buf)
+            self.assertEqual(err.exception.limit, "max_string")
+        for buf in ("'a\x01b' " + big, "'abc" + big, "'ab"):
+            with self.assertRaises(arson.ParserErr) as err:
+                codec(max_string=3).parse(buf)
+            self.assertNotIsInstance(err.exception, arson.LimitErr)
+
+        c = codec(max_size=32, max_depth=2, max_string=3, max_digits=5, max_items=3, max_nodes=5)
+        self.assertEqual(c.parse("[[1], 'abc', 12345]"), [[1], 'abc', 12345])
+        self.assertEqual(c.parse_all("[1, 2, 3] [4, 5]"), [[1, 2, 3], [4, 5]])
+
+        buf = "[" + "[1, 2], " * 20 + "]"
+        self.assertEqual(codec(max_items=20).parse_parallel(buf, chunk_size=10), [[1, 2]] * 20)
+        for limits in (dict(max_items=19), dict(max_nodes=60)):
+            with self.assertRaises(arson.LimitErr) as expected:
+                codec(**limits).parse(buf)
+            with self.assertRaises(arson.LimitErr) as actual:
+                codec(**limits).parse_parallel(buf, chunk_size=10)
+            self.assertEqual(str(actual.exception), str(expected.exception))
+
+    def test_parse_tree(self):
+        buf = """# config
+{
+    "name": 'svc',  # the name
+    "ports": [80, 443,],
+    "db": {"host": "x", "port": 5432},
+    "empty": {},
+}
+"""
+        doc = arson.parse_tree(buf)
+        self.assertEqual(doc.dump(), buf)
+        self.assertEqual(doc.root.value, arson.parse(buf))
+        self.assertEqual(doc.root.keys(), ["name", "ports", "db", "empty"])
+        self.assertEqual(doc.root["ports"][1].value, 443)
+
+        doc.root["name"].replace("svc2")
+        self.assertEqual(doc.changes(), [(23, 28, '"svc2"')])
+        doc.root["ports"].append(8080)
+        doc.root["ports"].delete(0)
+        doc.root["db"]["port"].replace(6543)
+        doc.root["empty"].set("k", [1])
+        doc.root.set("new", True)
+        doc.root["db"].delete("host")
+        self.assertEqual(doc.dump(), """# config
+{
+    "name": "svc2",  # the name
+    "ports": [443, 8080,],
+    "db": {"port": 6543},
+    "empty": {"k": [1]}, "new": true,
+}
+""")
+        self.assertEqual(doc.root.value, arson.parse(doc.dump()))
+
+        port = doc.root["db"]["port"]
+        doc.root["db"].replace(None)
+        with self.assertRaises(ValueError):
+            port.replace(1)
+        self.assertEqual(doc.root["db"].value, None)
+
+        doc = arson.parse_tree("{'a': 1, # only\n}")
+        doc.root.set("b", 2)
+        doc.root.delete("a")
+        self.assertEqual(doc.dump(), '{"b": 2 # only\n}')
+
+        doc = arson.parse_tree("{'a': [1, 2]}")
+        a = doc.root["a"]
+        a.replace([9])
+        a.replace([8])
+        for edit in (lambda: a.append(3), lambda: a.delete(0)):
+            with self.assertRaises(ValueError):
+                edit()
+            self.assertEqual(doc.dump(), "{'a': [8]}")
+        doc.root.replace({'z': 1})
+        with self.assertRaises(ValueError):
+            doc.root.set("q", 2)
+        self.assertEqual(doc.dump(), '{"z": 1}')
+
+        for buf, empty in (("{'a': 1, 'b': 2,}", {}), ("[1, 2,]", [])):
+            doc = arson.parse_tree(buf)
+            doc.root.delete(doc.root.keys()[1] if doc.root.kind == 'record' else 1)
+            self.assertEqual(doc.root.value, arson.parse(doc.dump()))
+            doc.root.delete(doc.root.keys()[0] if doc.root.kind == 'record' else 0)
+            self.assertEqual(arson.parse(doc.dump()), empty)
+
+        doc = arson.parse_tree("[1, 2, 3]")
+        doc.root[1].replace(9)
+        doc.root.delete(1)
+        self.assertEqual(doc.dump(), "[1, 3]")
+
+        doc = arson.parse_tree("{'s': @set [1, 2], 'c': @complex [1, 2]}")
+        for edit in (lambda: doc.root["s"].append(1), lambda: doc.root["s"][0].replace(2),
+                lambda: doc.root["c"].append(3)):
+            with self.assertRaises((arson.ParserErr, arson.SemanticErr, TypeError)):
+                edit()
+        self.assertEqual(doc.dump(), "{'s': @set [1, 2], 'c': @complex [1, 2]}")
+        doc.root["s"].append(3)
+        doc.root["s"].delete(0)
+        self.assertEqual(doc.dump(), "{'s': @set [2, 3], 'c': @complex [1, 2]}")
+
+    def test_parse_stream(self):
+        buf = "1 [2] -2.5E-3 0x1F # three\n{\n'a': 'x\\\nyy',\n'b': [1,\n2]}\n'end'"
+        for chunk_size in range(1, 12):
+            out = arson.codec.parse_stream(io.StringIO(buf), chunk_size=chunk_size)
+            self.assertEqual(list(out), arson.parse_all(buf))
+
+        buf = "{'a': 1}\n{'a': 1, 'a': 2}\n[1, 2\n'ok'\n{\n'b': ?\n}\n[2]\n"
+        expected = []
+        self.assertEqual(arson.parse_all(buf, errors=expected), [{'a': 1}, 'ok', [2]])
+        for chunk_size in range(1, 20):
+            errors = []
+            out = arson.codec.parse_stream(io.StringIO(buf), errors=errors, chunk_size=chunk_size)
+            self.assertEqual(list(out), [{'a': 1}, 'ok', [2]])
+            self.assertEqual([(e.index, e.line, e.column, e.offset) for e in errors],
+                    [(e.index, e.line, e.column, e.offset) for e in expected])
+
+        with self.assertRaises(arson.ParserErr):
+            list(arson.codec.parse_stream(io.StringIO("[1] [2")))
+
+        codec = arson.Codec(None, None, arson.Limits(max_size=10))
+        errors = []
+        out = codec.parse_stream(io.StringIO("[1]\n'" + "x" * 100 + "'\n[2]"), errors=errors, chunk_size=4)
+        self.assertEqual(list(out), [[1], [2]])
+        self.assertEqual([e.exception.limit for e in errors], ["max_size"])
+
+    def run_cli(self, *args, input='', env=None):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(arson.__file__)), **(env or {}))
+        p = subprocess.run([sys.executable] + list(args), input=input.encode('utf-8'),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, timeout=60)
+        return p.returncode, p.stdout.decode('utf-8'), p.stderr.decode('utf-8')
+
+    def test_cli(self):
+        buf = "{'a': [1, {}], # comment\n'b': @set [1]}\n[1,\n2] 'x'\n"
+        self.assertEqual(self.run_cli('-m', 'arson', input=buf), (0, '', ''))
+        self.assertEqual(self.run_cli('-m', 'arson', 'format', input=buf),
+                (0, '{"a": [1, {}], "b": @set [1]}\n[1, 2]\n"x"\n', ''))
+        self.assertEqual(self.run_cli('-m', 'arson', 'format', '--minify', input=buf)[1],
+                '{"a":[1,{}],"b":@set [1]}\n[1,2]\n"x"\n')
+        status, out, err = self.run_cli('-m', 'arson', 'format', '--indent', '2', input=buf)
+        self.assertEqual(out.split('\n')[:4], ['{', '  "a": [', '    1,', '    {}'])
+        self.assertEqual(arson.parse_all(out), arson.parse_all(buf))
+
+        self.assertEqual(self.run_cli('-m', 'arson', 'validate', input="[1]\n[1, 2\n'ok'\n"),
+                (1, '', '<stdin>:3:1: Expecting a \',\', or a \']\' but found "\'"\n'))
+
+        status, out, err = self.run_cli('-m', 'arson', 'to-json', input="{'a': [1, 'é']}\n@set [1]\n")
+        self.assertEqual((status, out), (1, '{"a": [1, "é"]}\n'))
+        self.assertTrue(err.startswith("<stdin>:document 2: can't be written as json"))
+        status, out, err = self.run_cli('-m', 'arson', 'from-json', input='{"a": [1.5, null]}\n{"a": 1, "a": 2}\n"\\u00e9"')
+        self.assertEqual((status, out, err), (1, '{"a": [1.5, null]}\n"é"\n', '<stdin>:2:1: duplicate key\n'))
+        status, out, err = self.run_cli('-m', 'arson', 'from-json', input='{"a":\n 1,\n "a": 2}\n[3]\n"\\ud800"\n[4]')
+        self.assertEqual((status, out), (1, '[3]\n[4]\n'))
+        self.assertEqual(err.splitlines(), ['<stdin>:1:1: duplicate key',
+                "<stdin>:document 3: can't be written as utf-8: surrogates not allowed"])
+        status, out, err = self.run_cli('-m', 'arson', 'to-json', input='{1: "a", "1": "b"}\n[{"x": [{null: 1}]}]\n')
+        self.assertEqual((status, out), (1, ''))
+        self.assertEqual(err.splitlines(), ["<stdin>:document 1: can't be written as json: keys must be strings, not int",
+                "<stdin>:document 2: can't be written as json: keys must be strings, not NoneType"])
+        status, out, err = self.run_cli('-m', 'arson', input="[1]\n@foo 1\n[@complex [1, 2, 3]]\n[2]\n")
+        self.assertEqual((status, out), (1, ''))
+        self.assertEqual(err.splitlines(), ['<stdin>:2:1: Unknown tag: @foo',
+                '<stdin>:3:2: Invalid @complex: complex() takes at most 2 arguments (3 given)'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.arson')
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write("[1,\n 2,\n ?]\n")
+            self.assertTrue(self.run_cli('-m', 'arson', path)[2].startswith(path + ":3:2: Unknown Character '?'"))
+            self.assertEqual(self.run_cli('-m', 'arson', os.path.join(tmp, 'missing'))[0], 2)
+        self.assertEqual(self.run_cli('-m', 'arson', '--bad')[0], 2)
+
+        # importing arson should be quick, and leave the heavy modules until they're used
+        script = "import sys, arson; print(' '.join(sorted(set(sys.modules) & {})))".format(
+                {'re', 'json', 'base64', 'hashlib', 'threading', 'copy', 'collections', 'array'})
+        self.assertEqual(self.run_cli('-c', script), (0, '\n', ''))
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {'PYTHONDONTWRITEBYTECODE': '', 'PYTHONPYCACHEPREFIX': tmp}
+            times = []
+            for _ in range(4):
+                status, out, err = self.run_cli('-X', 'importtime', '-c', 'import arson', env=env)
+                line = [l for l in err.splitlines() if l.endswith('| arson')][0]
+                times.append(int(line.split('|')[1]))
+            self.assertLess(min(times[1:]), 20000) # microseconds, after the first run writes .pyc files
+
+    def test_fuzz(self):
+        from tests import fuzz
+        report = fuzz.run(seed=0, cases=150, bench_size=0)
+        self.assertEqual(report.failures, [], str(report))
+        self.assertEqual(set(report.cases), {e.name for e in fuzz.engines})
+
+        # a fast path that loses the sign of -0.0 is caught, and shrunk
+        def positive_zero(obj):
+            return 0.0 if obj == 0.0 and type(obj) is float else obj
+        broken = fuzz.Engine('broken', 'parse', lambda buf: positive_zero(arson.parse(buf)), fuzz.reference_parse)
+        with mock.patch.object(fuzz, 'engines', [broken]):
+            report = fuzz.run(seed=0, cases=300, bench_size=0)
+        self.assertTrue(report.failures)
+        for name, case, expected, actual in report.failures:
+            self.assertEqual(arson.parse(case), -0.0)
+            self.assertLessEqual(len(case), 6)
+        self.assertEqual(fuzz.shrink_object([1, [2, {'a': 'xyz'}]], lambda obj: 'xyz' in str(obj)), 'xyz')
+
+        # and so is a delete that leaves the commas behind
+        def delete(self, key):
+            node = self[key]
+            if self.kind == 'record':
+                del self.index[key]
+            node.deleted = True
+            self.doc.edit(node.start if node.key is None else node.key.start, node.end, '')
+        with mock.patch.object(arson.TreeNode, 'delete', delete):
+            report = fuzz.run(seed=0, cases=100, names=['edits'], bench_size=0)
+        self.assertTrue(report.failures)
 
 if __name__ == '__main__':
     unittest.main()